@@ -0,0 +1,118 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from make_epub import make_epub
+from nuber.rust_module.nuber import Book, TermSize
+
+# geometry of the (imaginary) terminal the book is laid out for
+TERM_SIZE = (50, 80, 800, 1000)
+QUERY = "fox"
+
+# what a launch of the reader does before the first chapter is on screen,
+# run in a fresh process (with nothing cached) to time a cold start.
+LAUNCH = """
+import sys
+from nuber.rust_module.nuber import Book, TermSize
+path, cache_dir, mode = sys.argv[1:]
+if mode == "images":
+    import ueberzug.lib.v0
+book = Book(path, cache_dir, TermSize(*{term_size}), text_only=mode == "text_only")
+book.render_current_chapter()
+""".format(term_size=TERM_SIZE)
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - start
+
+
+def measure(path: str, repeat: int) -> dict[str, list[float]]:
+    term_size = TermSize(*TERM_SIZE)
+    timings = {name: [] for name in ("startup_cold", "number_of_lines_cold", "startup_warm",
+                                     "number_of_lines_warm", "render", "search")}
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # a cold start has nothing cached, a warm one reuses what the cold one left behind
+            start = time.perf_counter()
+            book = Book(path, cache_dir, term_size)
+            timings["startup_cold"].append(time.perf_counter() - start)
+            timings["number_of_lines_cold"].append(timed(book.number_of_lines))
+            del book
+
+            start = time.perf_counter()
+            book = Book(path, cache_dir, term_size)
+            timings["startup_warm"].append(time.perf_counter() - start)
+            timings["number_of_lines_warm"].append(timed(book.number_of_lines))
+
+            # every chapter, rendered and searched the way the reader opens it
+            for chapter in range(book.get_num_chapters()):
+                book.set_current_chapter(chapter)
+                timings["render"].append(timed(book.render_current_chapter))
+                timings["search"].append(timed(book.highlight_query_in_current_chapter, QUERY))
+    return timings
+
+
+def measure_launch(path: str, repeat: int) -> dict[str, list[float]]:
+    # cold starts of both modes, including the interpreter and the imports
+    timings = {"launch_images": [], "launch_text_only": []}
+    for _ in range(repeat):
+        for mode in ("images", "text_only"):
+            with tempfile.TemporaryDirectory() as cache_dir:
+                start = time.perf_counter()
+                subprocess.run([sys.executable, "-c", LAUNCH, path, cache_dir, mode], check=True)
+                timings[f"launch_{mode}"].append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings: dict[str, list[float]]) -> dict[str, dict[str, float]]:
+    return {name: {"min": min(samples), "median": statistics.median(samples)}
+            for name, samples in timings.items() if samples}
+
+
+def compare(summary: dict, baseline: dict, tolerance: float) -> list[str]:
+    # medians slower than the baseline by more than `tolerance`
+    return [name for name, stats in summary.items()
+            if name in baseline and stats["median"] > baseline[name]["median"] * (1 + tolerance)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="time the book engine on a synthetic epub")
+    parser.add_argument("--epub", help="book to measure, a synthetic one is generated by default")
+    parser.add_argument("--chapters", type=int, default=40)
+    parser.add_argument("--paragraphs", type=int, default=200, help="paragraphs per chapter")
+    parser.add_argument("--images", type=int, default=2, help="images per chapter")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write the summary to this json file")
+    parser.add_argument("--baseline", help="json summary of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown, as a fraction")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = args.epub
+        if path is None:
+            path = os.path.join(tmp_dir, "book.epub")
+            make_epub(path, args.chapters, args.paragraphs, args.images)
+        summary = summarize(measure(path, args.repeat) | measure_launch(path, args.repeat))
+
+    for name, stats in summary.items():
+        print(f"{name:<24}{stats['min'] * 1000:>10.2f}ms{stats['median'] * 1000:>10.2f}ms")
+    if args.output:
+        with open(args.output, "w") as output:
+            output.write(json.dumps(summary, indent=2))
+    if args.baseline:
+        with open(args.baseline, "r") as baseline:
+            regressions = compare(summary, json.loads(baseline.read()), args.tolerance)
+        for name in regressions:
+            print(f"regression: {name}", file=sys.stderr)
+        if regressions:
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
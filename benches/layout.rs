@@ -0,0 +1,69 @@
+use criterion::{criterion_group, criterion_main, BenchmarkId, Criterion, Throughput};
+use nuber::layout::{number_of_lines, render};
+use nuber::{ImageStore, TermSize};
+use rayon::ThreadPoolBuilder;
+use std::path::PathBuf;
+
+const PARAGRAPH: &str = "<p>the quick brown fox jumps over the <i>lazy</i> dog \
+    and the <b>cat</b> watches it from the other side of the fence</p>";
+const NUM_CHAPTERS: usize = 32;
+
+const TERM_SIZE: TermSize = TermSize {
+    row: 50,
+    col: 80,
+    x: 800,
+    y: 1000,
+};
+
+fn chapter(num_paragraphs: usize) -> String {
+    format!(
+        "<html><body>{}</body></html>",
+        PARAGRAPH.repeat(num_paragraphs)
+    )
+}
+
+// a book of `NUM_CHAPTERS` chapters, each a few hundred lines long
+fn chapters() -> Vec<String> {
+    (0..NUM_CHAPTERS).map(|_| chapter(200)).collect()
+}
+
+// the time to count the lines of a book should drop roughly
+// with the number of threads laying it out.
+fn layout(c: &mut Criterion) {
+    let chapters = chapters();
+    let images = ImageStore::empty(PathBuf::new());
+    let mut group = c.benchmark_group("number_of_lines");
+    let max_threads = rayon::current_num_threads();
+    let mut num_threads = 1;
+    while num_threads <= max_threads {
+        let pool = ThreadPoolBuilder::new()
+            .num_threads(num_threads)
+            .build()
+            .unwrap();
+        group.bench_with_input(
+            BenchmarkId::from_parameter(num_threads),
+            &chapters,
+            |b, chapters| b.iter(|| pool.install(|| number_of_lines(chapters, &images, TERM_SIZE))),
+        );
+        num_threads *= 2;
+    }
+    group.finish();
+}
+
+// rendering the chapter being opened, the time per line should stay flat.
+fn render_chapter(c: &mut Criterion) {
+    let images = ImageStore::empty(PathBuf::new());
+    let mut group = c.benchmark_group("render_chapter");
+    for num_paragraphs in [50, 200, 1_000] {
+        let html = chapter(num_paragraphs);
+        let num_lines = render(&html, &images, TERM_SIZE).len();
+        group.throughput(Throughput::Elements(num_lines as u64));
+        group.bench_with_input(BenchmarkId::from_parameter(num_lines), &html, |b, html| {
+            b.iter(|| render(html, &images, TERM_SIZE))
+        });
+    }
+    group.finish();
+}
+
+criterion_group!(benches, layout, render_chapter);
+criterion_main!(benches);
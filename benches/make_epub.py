@@ -0,0 +1,119 @@
+import argparse
+import random
+import struct
+import zipfile
+import zlib
+
+WORDS = ("the quick brown fox jumps over lazy dog and cat watches it from other side "
+         "of fence while river runs past old mill under grey sky").split()
+
+CONTAINER = """<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+
+def png(width: int, height: int, seed: int) -> bytes:
+    # a single colour rgb image, big in pixels but small on disk
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    color = bytes((seed * 67 % 256, seed * 131 % 256, seed * 199 % 256))
+    raw = (b"\x00" + color * width) * height
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw))
+            + chunk(b"IEND", b""))
+
+
+def paragraph(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(40, 120))]
+    # some styled and linked spans, like in a real book
+    for tag in ("i", "b", "a"):
+        i = rng.randrange(len(words))
+        attributes = ' href="#"' if tag == "a" else ""
+        words[i] = f"<{tag}{attributes}>{words[i]}</{tag}>"
+    return f"<p>{' '.join(words)}</p>"
+
+
+def chapter(idx: int, paragraphs: int, images: list[str], rng: random.Random) -> str:
+    body = [f"<h1>Chapter {idx + 1}</h1>"]
+    # images are spread evenly over the chapter
+    every = paragraphs // (len(images) + 1) or 1
+    images = list(images)
+    for i in range(paragraphs):
+        body.append(paragraph(rng))
+        if images and (i + 1) % every == 0:
+            body.append(f'<p><img src="images/{images.pop(0)}" alt=""/></p>')
+    return ('<?xml version="1.0" encoding="utf-8"?>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml">'
+            f"<head><title>Chapter {idx + 1}</title></head>"
+            f"<body>{''.join(body)}</body></html>")
+
+
+def make_epub(path: str, chapters: int = 20, paragraphs: int = 100, images: int = 0,
+              image_size: tuple[int, int] = (1600, 2400), seed: int = 0) -> None:
+    # `chapters` chapters of `paragraphs` paragraphs and `images` images each
+    rng = random.Random(seed)
+    manifest = []
+    spine = []
+    nav_points = []
+    with zipfile.ZipFile(path, "w") as epub:
+        # the mimetype has to come first, uncompressed
+        epub.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        epub.writestr("META-INF/container.xml", CONTAINER, compress_type=zipfile.ZIP_DEFLATED)
+        for idx in range(chapters):
+            names = [f"image{idx}_{i}.png" for i in range(images)]
+            for i, name in enumerate(names):
+                epub.writestr(f"OEBPS/images/{name}", png(*image_size, idx * images + i),
+                              compress_type=zipfile.ZIP_STORED)
+                manifest.append(f'<item id="img{idx}_{i}" href="images/{name}" media-type="image/png"/>')
+            epub.writestr(f"OEBPS/chapter{idx}.xhtml", chapter(idx, paragraphs, names, rng),
+                          compress_type=zipfile.ZIP_DEFLATED)
+            manifest.append(f'<item id="chapter{idx}" href="chapter{idx}.xhtml" '
+                            'media-type="application/xhtml+xml"/>')
+            spine.append(f'<itemref idref="chapter{idx}"/>')
+            nav_points.append(f'<navPoint id="nav{idx}" playOrder="{idx + 1}">'
+                              f"<navLabel><text>Chapter {idx + 1}</text></navLabel>"
+                              f'<content src="chapter{idx}.xhtml"/></navPoint>')
+
+        epub.writestr("OEBPS/content.opf", f"""<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="2.0" unique-identifier="id">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:title>Synthetic book</dc:title>
+    <dc:identifier id="id">synthetic-{seed}</dc:identifier>
+    <dc:language>en</dc:language>
+  </metadata>
+  <manifest>
+    <item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>
+    {"".join(manifest)}
+  </manifest>
+  <spine toc="ncx">{"".join(spine)}</spine>
+</package>
+""", compress_type=zipfile.ZIP_DEFLATED)
+        epub.writestr("OEBPS/toc.ncx", f"""<?xml version="1.0" encoding="utf-8"?>
+<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">
+  <head><meta name="dtb:uid" content="synthetic-{seed}"/></head>
+  <docTitle><text>Synthetic book</text></docTitle>
+  <navMap>{"".join(nav_points)}</navMap>
+</ncx>
+""", compress_type=zipfile.ZIP_DEFLATED)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="generate a synthetic epub")
+    parser.add_argument("path")
+    parser.add_argument("--chapters", type=int, default=20)
+    parser.add_argument("--paragraphs", type=int, default=100, help="paragraphs per chapter")
+    parser.add_argument("--images", type=int, default=0, help="images per chapter")
+    parser.add_argument("--image-size", type=int, nargs=2, default=(1600, 2400), metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    make_epub(args.path, args.chapters, args.paragraphs, args.images, tuple(args.image_size), args.seed)
+
+
+if __name__ == "__main__":
+    main()
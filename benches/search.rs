@@ -0,0 +1,59 @@
+use criterion::{criterion_group, criterion_main, BenchmarkId, Criterion, Throughput};
+use nuber::search::{ChapterText, Matcher, SearchOptions};
+
+const LINE: &str = "the quick brown fox jumps over the lazy dog and the cat";
+
+// a chapter made of `num_lines` lines of text, the way
+// `render_current_chapter_text` lays them out.
+fn chapter(num_lines: usize) -> ChapterText {
+    let mut text = String::new();
+    let mut lines_len = Vec::new();
+    for _ in 0..num_lines {
+        text.push_str(LINE);
+        text.push(' ');
+        lines_len.push(LINE.chars().count() + 1);
+    }
+    ChapterText::new(&text, lines_len)
+}
+
+// the time per match should stay flat as the number of matches grows,
+// in every search mode.
+fn highlight(c: &mut Criterion) {
+    let modes = [
+        ("plain", SearchOptions::default(), "the"),
+        (
+            "whole_word",
+            SearchOptions {
+                whole_word: true,
+                ..SearchOptions::default()
+            },
+            "the",
+        ),
+        (
+            "regex",
+            SearchOptions {
+                regex: true,
+                ..SearchOptions::default()
+            },
+            "th[ae]",
+        ),
+    ];
+    for (name, options, query) in modes {
+        let matcher = Matcher::new(query, options).unwrap();
+        let mut group = c.benchmark_group(format!("highlight/{}", name));
+        for num_lines in [1_000, 10_000, 50_000] {
+            let text = chapter(num_lines);
+            let num_matches = text.highlights(&matcher).len();
+            group.throughput(Throughput::Elements(num_matches as u64));
+            group.bench_with_input(
+                BenchmarkId::from_parameter(num_matches),
+                &text,
+                |b, text| b.iter(|| text.highlights(&matcher)),
+            );
+        }
+        group.finish();
+    }
+}
+
+criterion_group!(benches, highlight);
+criterion_main!(benches);
@@ -1,18 +1,64 @@
 from .reader import Reader
+from .config import load_config
+from .export import export as export_book
+from .library import choose_book
 import click
+import shutil
 import signal
 
 __version__ = '1.0.1'
 
-@click.command()
-@click.argument("book", type=click.Path(exists=True))
+
+class DefaultGroup(click.Group):
+    # arguments not naming a subcommand go to `read`, so `nuber BOOK`
+    # keeps reading a book.
+    def parse_args(self, ctx, args):
+        if args[:1] != ["--help"] and (not args or args[0] not in self.commands):
+            args = ["read", *args]
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=DefaultGroup)
+def main():
+    pass
+
+
+@main.command()
+@click.argument("book", required=False, type=click.Path(exists=True))
 @click.option("-c", "--config", type=click.Path(exists=True))
-def main(book, config):
-    reader = Reader(click.format_filename(book), config_path=config)
+@click.option("--library", type=click.Path(exists=True, file_okay=False),
+              help="Choose the book out of the epubs under this directory.")
+@click.option("--instrument", is_flag=True, help="Record latency histograms into the cache directory.")
+@click.option("--text-only", is_flag=True, help="Leave images out, without starting Überzug.")
+def read(book, config, library, instrument, text_only):
+    """Read BOOK (the default command)."""
+    chapter = None
+    if library is not None:
+        if (chosen := choose_book(library, load_config(config))) is None:
+            return
+        book, chapter = chosen
+    elif book is None:
+        raise click.UsageError("Missing argument 'BOOK' (or --library).")
+    reader = Reader(click.format_filename(book), config_path=config, instrument=instrument, text_only=text_only,
+                    chapter=chapter)
 
     def signal_handler(*_):
         reader.action_quit(None)
 
     signal.signal(signal.SIGHUP, signal_handler)
     signal.signal(signal.SIGINT, signal_handler)
-    reader.loop() # type: ignore
+    reader.loop()
+
+
+@main.command()
+@click.argument("book", type=click.Path(exists=True, dir_okay=False))
+@click.option("-o", "--output", type=click.File("w", encoding="utf-8"), default="-",
+              help="File to write to, stdout by default.")
+@click.option("-w", "--width", type=click.IntRange(1, 65535),
+              help="Columns to lay the text out in, the terminal's width by default.")
+@click.option("--ansi", is_flag=True, help="Keep the styles of the text as ANSI escape codes.")
+def export(book, output, width, ansi):
+    """Write BOOK out as text, the way it is laid out when read."""
+    if width is None:
+        width = shutil.get_terminal_size().columns
+    export_book(click.format_filename(book), output, width, ansi)
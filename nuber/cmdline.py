@@ -1,5 +1,8 @@
 import curses
-from typing import Tuple
+from typing import Callable, Tuple
+
+# milliseconds between calls to `on_idle` while waiting for keys, see `run`
+IDLE_INTERVAL = 20
 
 class CmdLine:
     def __init__(self, stdscr: curses.window, prompt=":") -> None:
@@ -8,6 +11,8 @@ class CmdLine:
         self.action = ""
         self.prompt = prompt
         self.focused = True
+        # shown at the right end of the line, e.g. the number of matches
+        self.status = ""
 
         self.keys = {
                 10: self.action_select,                         # key_enter
@@ -59,20 +64,40 @@ class CmdLine:
         # purely for cosmetic reasons
         self.input.addstr(0, 1, " " * (self.cols - 1), curses.A_REVERSE)
         self.input.addstr(0, 1, self.crop_text(self.command), curses.A_REVERSE)
+        if self.status and len(self.command) + len(self.status) + 2 < self.cols:
+            self.input.addstr(0, self.cols - len(self.status) - 1, self.status, curses.A_REVERSE | curses.A_BOLD)
         self.input.refresh()
 
-    def run(self, command="", prompt=":") -> Tuple[str, str]:
+    def run(self, command="", prompt=":", on_change: Callable[[str], None] | None = None,
+            on_idle: Callable[[], str | None] | None = None) -> Tuple[str, str]:
+        # `on_change` is called with the command after every edit, `on_idle`
+        # every IDLE_INTERVAL ms without keys (and after every key), returning
+        # the status to show or None to keep the last one.
         self.prompt = prompt
         self.rows, self.cols = self.stdscr.getmaxyx()
         self.command = command
+        self.status = ""
         self.input = curses.newwin(1, self.cols + 1, self.rows - 1, 0)
         self.input.keypad(True)
+        self.input.timeout(-1 if on_idle is None else IDLE_INTERVAL)
         self.focused = True
         self.redraw()
 
         while self.focused:
-            ch = self.input.get_wch()
-            self.on_key(ch)
-            self.redraw()
+            try:
+                ch = self.input.get_wch()
+            except curses.error:
+                # no key pressed in time
+                ch = None
+            drawn = (self.command, self.status)
+            if ch is not None:
+                self.on_key(ch)
+                if self.focused and on_change is not None and self.command != drawn[0]:
+                    on_change(self.command)
+            if self.focused and on_idle is not None and (status := on_idle()) is not None:
+                self.status = status
+            # idle ticks which changed nothing leave the line as it is
+            if (self.command, self.status) != drawn:
+                self.redraw()
         return self.action, self.command
 
@@ -1,4 +1,6 @@
+import appdirs
 import curses
+import os
 import toml
 from string import ascii_letters
 from typing import Any, TypeVar
@@ -36,3 +38,25 @@ class Config:
             b = int(val[4:6], 16) * 1000 // 256
             return r, g, b
         return None
+
+
+def load_config(config_path: str | None = None) -> Config:
+    # <config_path>/config.toml, created empty when missing
+    if config_path is None:
+        config_path = os.path.join(appdirs.user_config_dir(), "nuber")
+    if not os.path.exists(config_path):
+        os.mkdir(config_path)
+    config_file_path = os.path.join(config_path, "config.toml")
+    if not os.path.exists(config_file_path):
+        with open(config_file_path, "x"):
+            pass
+    return Config(config_file_path)
+
+
+def cache_dir(config: Config) -> str:
+    path = config.get("cache_dir")
+    if path is None:
+        path = os.path.join(appdirs.user_cache_dir(), "nuber")
+    if not os.path.exists(path):
+        os.mkdir(path)
+    return path
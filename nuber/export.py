@@ -0,0 +1,17 @@
+import os
+import sys
+from typing import TextIO
+from .rust_module.nuber import BookExport
+
+
+def export(path: str, output: TextIO, width: int, ansi: bool = False) -> None:
+    # every chapter in order, written out as soon as it is rendered
+    try:
+        for text in BookExport(path, width, ansi):
+            output.write(text)
+        output.flush()
+    except BrokenPipeError:
+        # whoever read the pipe (e.g. head) is gone, and so is the rest of the book.
+        # stdout is pointed at devnull so flushing it on exit fails quietly.
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
@@ -0,0 +1,93 @@
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+# actions timed together, the rest are timed under their own name
+ACTION_KINDS = {
+    "scroll_down": "scroll",
+    "scroll_up": "scroll",
+    "top": "scroll",
+    "bottom": "scroll",
+    "next_chapter": "chapter",
+    "previous_chapter": "chapter",
+    "open_search": "search",
+    "next_search": "search",
+    "prev_search": "search",
+    "resize": "resize",
+}
+
+# actions waiting on the user in a prompt or a list, timed from the moment
+# it closes (see `Instrument.overlay_closed`) instead of the key press
+OVERLAY_ACTIONS = {"open_search", "open_cmd", "add_bookmark", "open_toc", "open_bookmarks"}
+
+
+# latencies in buckets of powers of two microseconds, like the book's,
+# see src/timings.rs
+class Histogram:
+    def __init__(self) -> None:
+        self.counts: dict[int, int] = {}
+
+    def record(self, seconds: float) -> None:
+        bound = 1 << int(seconds * 1_000_000).bit_length()
+        self.counts[bound] = self.counts.get(bound, 0) + 1
+
+    def buckets(self) -> dict[int, int]:
+        return dict(sorted(self.counts.items()))
+
+
+# opt-in timers around the reader's actions (keypress to paint) and the stages
+# of drawing them. disabled, timing a block costs a nullcontext.
+class Instrument:
+    def __init__(self, enabled: bool = False) -> None:
+        self.enabled = enabled
+        self.actions: dict[str, Histogram] = {}
+        self.stages: dict[str, Histogram] = {}
+        # (action kind, time of the key press) of the actions not painted yet
+        self.pending: list[tuple[str, float]] = []
+
+    @contextmanager
+    def _timed(self, histograms: dict[str, Histogram], name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            histograms.setdefault(name, Histogram()).record(time.perf_counter() - start)
+
+    def key_pressed(self, action: str) -> None:
+        if self.enabled and action not in OVERLAY_ACTIONS:
+            self.pending.append((ACTION_KINDS.get(action, action), time.perf_counter()))
+
+    def overlay_closed(self, action: str) -> None:
+        if self.enabled:
+            self.pending.append((ACTION_KINDS.get(action, action), time.perf_counter()))
+
+    def discard(self) -> None:
+        # the pending actions asked for no paint, they have no latency
+        self.pending = []
+
+    def painted(self) -> None:
+        # the latency of an action is from its key press until it is on screen
+        now = time.perf_counter()
+        for kind, start in self.pending:
+            self.actions.setdefault(kind, Histogram()).record(now - start)
+        self.pending = []
+
+    def stage(self, name: str):
+        if not self.enabled:
+            return nullcontext()
+        return self._timed(self.stages, name)
+
+    def dump(self, directory: str, book_stages: dict[str, dict[int, int]]) -> None:
+        # every session gets its own file, named after the time it ended
+        if not self.enabled:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+        timings = {
+            "actions": {name: histogram.buckets() for name, histogram in self.actions.items()},
+            "stages": {name: histogram.buckets() for name, histogram in self.stages.items()},
+            "book": book_stages,
+        }
+        with open(path, "w") as timings_file:
+            timings_file.write(json.dumps(timings, indent=2))
@@ -0,0 +1,63 @@
+import curses
+import os
+from .config import Config, cache_dir
+from .listview import ListView
+from .rust_module.nuber import Catalog, CatalogEntry
+from .state import StateStore
+from .toc import Toc
+
+
+class Library(ListView):
+    def __init__(self, stdscr: curses.window, entries: list[CatalogEntry], state: StateStore,
+                 keybinds: dict | None = None) -> None:
+        keys = {ord("t"): "open_toc"}
+        if keybinds is not None:
+            keys.update(keybinds)
+        data = [(self.label(entry, state), entry) for entry in entries]
+        super().__init__(stdscr, data, keybinds=keys)
+        self.title = "Library"
+
+    @staticmethod
+    def label(entry: CatalogEntry, state: StateStore) -> str:
+        label = f"{entry.title} - {entry.author}" if entry.author else entry.title
+        # progress of the books already opened, by chapter
+        if (book_state := state.load(entry.path)) is not None and entry.chapters:
+            label += f" ({book_state['chapter_idx'] * 100 // entry.chapters}%)"
+        return label
+
+    def action_open_toc(self) -> None:
+        if self.data:
+            self.action = "toc"
+            self.focused = False
+
+    def determine_selected_row(self, row: int) -> int:
+        return row
+
+
+def choose_book(directory: str, config: Config) -> tuple[str, int | None] | None:
+    # the book (and chapter, when picked from its table of contents) to open
+    # out of the epubs under `directory`. the books come from the catalog,
+    # only the new and changed ones are opened to list them.
+    stdscr = curses.initscr()
+    curses.noecho()
+    curses.curs_set(0)
+    cache = cache_dir(config)
+    entries = Catalog(cache).scan(os.path.abspath(directory))
+    library = Library(stdscr, entries, StateStore(cache), keybinds=config.keybinds("library_keybinds"))
+    while True:
+        stdscr.erase()
+        stdscr.refresh()
+        action, entry = library.run(library.selected_row)
+        if action == "select":
+            return entry.path, None
+        if action == "toc":
+            toc = Toc(stdscr, entry.toc, keybinds=config.keybinds("toc_keybinds"))
+            stdscr.erase()
+            stdscr.refresh()
+            action, chapter = toc.run(0)
+            if action == "select":
+                return entry.path, chapter
+        if action not in ("toc", "close", "resize"):
+            break
+    curses.endwin()
+    return None
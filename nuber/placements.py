@@ -0,0 +1,83 @@
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+import ueberzug.lib.v0 as ueberzug
+from .rust_module.nuber import Image
+
+# number of placements kept by ueberzug at most
+POOL_SIZE = 16
+
+
+# images of the current chapter, drawn through a fixed pool of placements.
+# slots are handed to the images in view and reused (least recently used first)
+# across chapters, so the number of placements never grows with the session.
+class Placements:
+    def __init__(self, size: int = POOL_SIZE) -> None:
+        self.size = size
+        # image key -> placement, from the least to the most recently used
+        self.slots: OrderedDict[tuple, ueberzug.Placement] = OrderedDict()
+        # (first row, key, x, image) of the chapter's images, sorted by row
+        self.images: list[tuple[int, tuple, int, Image]] = []
+        self.starts: list[int] = []
+        # the tallest image, bounds how far above the viewport an image
+        # intersecting it may start
+        self.max_height = 0
+        self.visible: dict[tuple, ueberzug.Placement] = {}
+
+    def add(self, position: tuple[int, int], info: Image) -> None:
+        x, y = position
+        # the downscaled copy is written in the background, once it is there
+        # the image gets a new key showing it instead of the original.
+        key = (x, y, info.display_path)
+        index = bisect_right(self.starts, y)
+        self.starts.insert(index, y)
+        self.images.insert(index, (y, key, x, info))
+        self.max_height = max(self.max_height, info.size[1])
+
+    def clear(self, canvas: ueberzug.Canvas) -> None:
+        self.hide(canvas)
+        self.images = []
+        self.starts = []
+        self.max_height = 0
+
+    def intersecting(self, top: int, bottom: int) -> list[tuple[int, tuple, int, Image]]:
+        # images with rows in [top, bottom]
+        start = bisect_left(self.starts, top - self.max_height)
+        end = bisect_right(self.starts, bottom)
+        return [image for image in self.images[start:end] if image[0] + image[3].size[1] >= top]
+
+    def acquire(self, canvas: ueberzug.Canvas, key: tuple, info: Image) -> ueberzug.Placement:
+        if (placement := self.slots.get(key)) is not None:
+            self.slots.move_to_end(key)
+            return placement
+        if len(self.slots) < self.size:
+            placement = canvas.create_placement(f"slot{len(self.slots)}")
+        else:
+            # reuse the least recently used slot not in view
+            old_key = next((k for k in self.slots if k not in self.visible), next(iter(self.slots)))
+            placement = self.slots.pop(old_key)
+            self.visible.pop(old_key, None)
+        placement.path = info.display_path
+        self.slots[key] = placement
+        return placement
+
+    def show(self, canvas: ueberzug.Canvas, offset: int, rows: int) -> None:
+        # only the images around the viewport are touched
+        padding = 1
+        in_view = self.intersecting(offset - padding, offset + rows + padding)
+        keys = {key for _, key, _, _ in in_view}
+        with canvas.synchronous_lazy_drawing:
+            for key in [key for key in self.visible if key not in keys]:
+                self.visible.pop(key).visibility = ueberzug.Visibility.INVISIBLE
+            for y, key, x, info in in_view:
+                placement = self.acquire(canvas, key, info)
+                placement.x, placement.y = x, y - offset
+                placement.width, placement.height = info.size
+                placement.visibility = ueberzug.Visibility.VISIBLE
+                self.visible[key] = placement
+
+    def hide(self, canvas: ueberzug.Canvas, predicate=None) -> None:
+        with canvas.synchronous_lazy_drawing:
+            for key, placement in list(self.visible.items()):
+                if predicate is None or predicate(placement):
+                    placement.visibility = ueberzug.Visibility.INVISIBLE
+                    del self.visible[key]
@@ -1,17 +1,76 @@
+from __future__ import annotations
 import curses
-import json
-import appdirs
 import os
-import ueberzug.lib.v0 as ueberzug
-from .rust_module.nuber import Book, Image
+import time
+from bisect import bisect_left
+from itertools import accumulate
+from typing import TYPE_CHECKING
+from .rust_module.nuber import Book, STYLES
 from .toc import Toc
 from .bookmarks import Bookmark
 from .cmdline import CmdLine
-from .config import Config
+from .config import cache_dir, load_config
+from .instrument import Instrument
+from .state import StateStore
+
+# Überzug (and the placements drawn through it) is only imported when
+# images are shown, see `loop`
+if TYPE_CHECKING:
+    import ueberzug.lib.v0 as ueberzug
+
+# seconds between saves of the reading state, see `autosave`
+AUTOSAVE_INTERVAL = 30
+
+# the screen is painted at most this many times a second, see `loop`
+FRAME_RATE = 60
+
+# milliseconds between checks on the line counts being recomputed after a resize
+LINES_JOB_POLL = 100
+
+# milliseconds between checks on the other chapters being searched, see `poll_chapter_search`
+CHAPTER_SEARCH_POLL = 20
+
+# actions whose repeated key presses are merged into a single bigger step
+STEP_ACTIONS = {"action_scroll_down", "action_scroll_up"}
+
+# search modes, set in the config as `search_<mode>` or with `:set [no]<mode>`
+SEARCH_MODES = ("regex", "whole_word", "smart_case")
+
+# curses attributes of the styles drawn as text
+STYLE_ATTRIBUTES = {
+    "bold": curses.A_BOLD,
+    "italic": curses.A_ITALIC,
+    "reverse": curses.A_REVERSE,
+    "underline": curses.A_UNDERLINE,
+}
+
+# curses attributes of every combination of style bits, spans carry their
+# style as bits so drawing them is a single lookup.
+ATTRIBUTES = [curses.A_NORMAL] * (1 << len(STYLES))
+for bits in range(len(ATTRIBUTES)):
+    for name, bit in STYLES.items():
+        if bits & bit:
+            ATTRIBUTES[bits] |= STYLE_ATTRIBUTES.get(name, curses.A_NORMAL)
+
+
+# stands in for `Placements` in text only mode, where no image is ever placed
+class NoPlacements:
+    def add(self, position: tuple[int, int], info) -> None:
+        pass
+
+    def clear(self, canvas: None) -> None:
+        pass
+
+    def show(self, canvas: None, offset: int, rows: int) -> None:
+        pass
+
+    def hide(self, canvas: None, predicate=None) -> None:
+        pass
 
 
 class Reader:
-    def __init__(self, path: str, config_path=None) -> None:
+    def __init__(self, path: str, config_path=None, instrument: bool = False, text_only: bool = False,
+                 chapter: int | None = None) -> None:
         # curses init
         self.path = os.path.abspath(path)
         self.stdscr: curses.window = curses.initscr()
@@ -25,17 +84,7 @@ class Reader:
         curses.init_pair(1, curses.COLOR_MAGENTA, -1)
         curses.init_pair(2, curses.COLOR_YELLOW, -1)
 
-        # read configuration file
-        if config_path == None:
-            config_path = os.path.join(appdirs.user_config_dir(), "nuber")
-        if not os.path.exists(config_path):
-            os.mkdir(config_path)
-        config_file_path = os.path.join(config_path, "config.toml")
-        if not os.path.exists(config_file_path):
-            with open(config_file_path, "x"):
-                pass
-
-        self.config = Config(config_file_path)
+        self.config = load_config(config_path)
 
         # override colors
         if color := self.config.color("highlight_color"):
@@ -43,40 +92,60 @@ class Reader:
         if color := self.config.color("highlight_color2"):
             curses.init_color(curses.COLOR_YELLOW, *color)
 
-        self.cache_dir = self.config.get("cache_dir")
-        if self.cache_dir is None:
-            self.cache_dir = os.path.join(appdirs.user_cache_dir(), "nuber")
-
-        if not os.path.exists(self.cache_dir):
-            os.mkdir(self.cache_dir)
-        self.state_file = os.path.join(self.cache_dir, "state.json")
-        self.book = Book(self.path)
-        self.lines = self.book.number_of_lines()
+        self.cache_dir = cache_dir(self.config)
+        self.state = StateStore(self.cache_dir)
+        self.autosave_interval = self.config.get("autosave_interval", AUTOSAVE_INTERVAL)
+        self.last_save = time.monotonic()
+        self.needs_paint = False
+        self.last_paint = 0.0
+        self.pad_dirty = False
+        # images are left out (with a placeholder) and Überzug is never started
+        self.text_only = text_only or bool(self.config.get("text_only", False))
+        self.book = Book(self.path, self.cache_dir, text_only=self.text_only)
+        self.instrument = Instrument(instrument)
+        if instrument:
+            self.book.enable_timings()
+        # memory budget (MiB) of rendered chapters kept by the book
+        if (chapter_cache_size := self.config.get("chapter_cache_size")) is not None:
+            self.book.set_chapter_cache_size(chapter_cache_size * 1024 * 1024)
+        self.update_lines()
 
         self.query = ""
         self.offset = 0
         self.current_position = 0
         self.chapter_idx = 0
         self.positions = [0] * self.book.get_num_chapters()
-        self.placements = {}
-        self.current_chapter_placements = []
+        if self.text_only:
+            self.placements = NoPlacements()
+        else:
+            from .placements import Placements
+            self.placements = Placements()
         self.word_count_per_line = []
+        # words_prefix[i] is the number of words before the i'th line
+        self.words_prefix = [0]
         self.highlights = []
         self.highlights_index = 0
+        # regex, whole_word and smart_case, toggled with `:set [no]<mode>`
+        self.search_modes = {mode: bool(self.config.get(f"search_{mode}", False)) for mode in SEARCH_MODES}
+        # chapters that may contain the query, see `Book.search_book`
+        self.search_chapters = []
+        # matches of the query being typed, see `search_as_typed`
+        self.search_job = None
+        # (job, direction) of the other chapters being searched, see `search_other_chapters`
+        self.chapter_search = None
         self.bookmarks = Bookmark(self.stdscr, keybinds=self.config.keybinds("bookmarks_keybinds"))
 
-        if os.path.exists(self.state_file):
-            with open(self.state_file, "r") as state_file:
-                states = json.loads(state_file.read())
-                try:
-                    state = states[self.path]
-                    self.positions = state["positions"]
-                    self.chapter_idx = state["chapter_idx"]
-                    self.bookmarks.load_bookmarks(state["bookmarks"])
-                    self.current_position = self.positions[self.chapter_idx]
-                    self.book.set_current_chapter(self.chapter_idx)
-                except KeyError:
-                    pass
+        if (state := self.state.load(self.path)) is not None:
+            self.positions = state["positions"]
+            self.chapter_idx = state["chapter_idx"]
+            self.bookmarks.load_bookmarks(state["bookmarks"])
+            self.current_position = self.positions[self.chapter_idx]
+            self.book.set_current_chapter(self.chapter_idx)
+        # opened at a chapter of its table of contents, see `choose_book`
+        if chapter is not None:
+            self.chapter_idx = chapter
+            self.current_position = 0
+            self.book.set_current_chapter(self.chapter_idx)
 
         self.toc = Toc(self.stdscr, self.book.get_toc(), keybinds=self.config.keybinds("toc_keybinds"))
         self.cmdline = CmdLine(self.stdscr)
@@ -105,88 +174,122 @@ class Reader:
         custom_keys = {k: getattr(self, f"action_{v}", self.action_noop) for k, v, in reader_keybinds}
         self.keys.update(custom_keys)
 
-    def add_image(self, canvas: ueberzug.Canvas, position: tuple[int, int], info: Image) -> None:
-        img_id = f"{position[0]}{position[1]}{info.path}"
-        if img_id in self.placements:
-            placement = self.placements[img_id]
-        else:
-            placement = canvas.create_placement(img_id)
-            placement.path = info.path
-            self.placements[img_id] = placement
-        placement.x, placement.y = position
-        placement.width, placement.height = info.size
-        self.current_chapter_placements.append((position[1], placement))
-
     def render_chapter(self, canvas: ueberzug.Canvas) -> None:
-        chapter = self.book.render_current_chapter()
-        self.chapter_rows = max(self.rows, len(chapter))
-        self.pad: curses.window = curses.newpad(self.chapter_rows, self.cols)
+        # a view on the laid out chapter, its rows cross into python only
+        # when drawn (see `draw_rows`).
+        with self.instrument.stage("layout"):
+            self.chapter = self.book.view_current_chapter()
+        self.chapter_len = self.chapter.end
+        self.chapter_rows = max(self.rows, self.chapter_len)
+        if self.lines_estimated and self.chapter_idx > 0:
+            # the current chapter is laid out by now, its count is exact
+            self.lines[self.chapter_idx - 1] = self.chapter_len
+            self.set_lines(self.lines, estimated=True)
+        # the pad only holds the visible rows and a margin around them,
+        # see `draw_viewport`.
+        self.viewport_margin = self.rows // 2
+        self.pad: curses.window = curses.newpad(self.rows + 2 * self.viewport_margin, self.cols)
+        self.pad_top: int | None = None
+        # chapter rows to draw again on the next paint, see `draw_viewport`
+        self.damaged_rows: set[int] = set()
+        # the highlights (and current highlight) drawn into the pad
+        self.drawn_highlights: list = []
+        self.drawn_highlights_index = 0
         self.percentage_win = curses.newwin(1, 10, 0, self.cols - 4)
-        self.highlights_win: curses.window | None = None
         # appears when searching
-        self.word_count_per_line = []
-        for line_num, elements in enumerate(chapter):
-            current_pos = 0
-            word_count = 0
-            for element in elements:
-                if info := element.image_info:
-                    if element.text.startswith("S"):
-                        self.add_image(canvas, (current_pos, line_num), info)
-                    current_pos += len(element.text)
-                else:
-                    current_pos += self.addstr(line_num, current_pos, element.text, element.style)
-                word_count += len(element.text.split())
-            self.word_count_per_line.append(max(1, word_count))
-
-    def redraw_text_formatting(self) -> None:
-        chapter = self.book.render_current_chapter()
-        for line_num, elements in enumerate(chapter):
-            current_pos = 0
-            word_count = 0
-            for element in elements:
-                if not element.image_info:
-                    current_pos += self.addstr(line_num, current_pos, element.text, element.style)
-                word_count += len(element.text.split())
-
-
-    def determine_visibility(self, y: int, h: int) -> ueberzug.Visibility:
-        y_pos = y - self.offset
-        padding = 1
-        if y_pos + h + padding < 0:
-            return ueberzug.Visibility.INVISIBLE
-        if y_pos - padding > self.rows:
-            return ueberzug.Visibility.INVISIBLE
-        return ueberzug.Visibility.VISIBLE
-
-    def addstr(self, y: int, x: int, text: str, styles: list) -> int:
-        formatting = curses.A_NORMAL
-        for style in styles:
-            if style == "bold":
-                formatting = formatting | curses.A_BOLD
-            elif style == "italic":
-                formatting = formatting | curses.A_ITALIC
-            elif style == "reverse":
-                formatting = formatting | curses.A_REVERSE
-            elif style == "underline":
-                formatting = formatting | curses.A_UNDERLINE
-
+        self.highlights_win: curses.window | None = None
+        self.invalidate()
+        self.word_count_per_line = self.chapter.word_counts()
+        self.words_prefix = list(accumulate(self.word_count_per_line, initial=0))
+        for position, info in self.chapter.images():
+            self.placements.add(position, info)
+
+    def draw_viewport(self) -> None:
+        # (re)fill the pad when the visible rows are not all in it,
+        # otherwise only draw the rows damaged since the last paint.
+        pad_rows, _ = self.pad.getmaxyx()
+        if self.pad_top is not None and self.pad_top <= self.offset \
+                and self.offset + self.rows <= self.pad_top + pad_rows:
+            if self.damaged_rows:
+                with self.instrument.stage("draw"):
+                    self.draw_rows(self.damaged_rows)
+                self.damaged_rows = set()
+                self.pad_dirty = True
+            return
+        self.pad_top = max(0, self.offset - self.viewport_margin)
+        with self.instrument.stage("draw"):
+            self.pad.erase()
+            self.draw_rows(range(self.pad_top, self.pad_top + pad_rows))
+        self.damaged_rows = set()
+        self.pad_dirty = True
+
+    def draw_rows(self, rows) -> None:
+        pad_rows, _ = self.pad.getmaxyx()
+        rows = {row for row in rows if 0 <= row - self.pad_top < pad_rows}
+        for line_num in rows:
+            self.pad.move(line_num - self.pad_top, 0)
+            self.pad.clrtoeol()
+            if line_num >= self.chapter_len:
+                continue
+            for column, text, style in self.chapter.spans(line_num):
+                self.addstr(line_num - self.pad_top, column, text, style)
+        self.draw_highlights(rows)
+        self.drawn_highlights = self.highlights
+        self.drawn_highlights_index = self.highlights_index
+
+    def addstr(self, y: int, x: int, text: str, style: int) -> int:
         try:
-            self.pad.addstr(y, x, text, formatting)
+            self.pad.addstr(y, x, text, ATTRIBUTES[style])
             return len(text)
         except curses.error:
             return 0
 
+    def update_lines(self) -> None:
+        self.set_lines(self.book.number_of_lines())
+        # the line counts being recomputed in the background, see `action_resize`
+        self.lines_job = None
+
+    def set_lines(self, lines: list[int], estimated: bool = False) -> None:
+        self.lines = lines
+        self.lines_estimated = estimated
+        # lines_prefix[i] is the number of lines before self.lines[i]
+        self.lines_prefix = list(accumulate(self.lines, initial=0))
+
+    def poll_lines_job(self) -> None:
+        if self.lines_job is None or (lines := self.lines_job.result()) is None:
+            return
+        self.lines_job = None
+        self.set_lines(lines)
+        self.update_progress()
+        self.redraw()
+
+    def position_at(self, offset: int) -> int:
+        return self.words_prefix[min(offset, len(self.words_prefix) - 1)]
+
     def update_offset(self) -> None:
-        self.offset = 0
-        while self.current_position > sum(self.word_count_per_line[:self.offset]):
-            self.offset += 1
+        # first line starting at (or after) the current position
+        offset = bisect_left(self.words_prefix, self.current_position)
+        self.offset = min(offset, len(self.words_prefix) - 1)
 
     def update_progress(self) -> None:
-        self.progress = sum(self.lines[:max(0, self.chapter_idx - 1)]) + self.offset + self.rows
+        self.progress = self.lines_prefix[max(0, self.chapter_idx - 1)] + self.offset + self.rows
+
+    @staticmethod
+    def highlight_rows(highlights: list) -> set[int]:
+        return {row + row_offset for (row, _), lines in highlights for row_offset in range(len(lines))}
 
     def highlight_query(self) -> None:
-        self.redraw_text_formatting()
-        if not self.highlights:
+        # the rows whose highlights changed are drawn again on the next redraw.
+        # moving between the matches of a query only restyles two of them.
+        if self.highlights is self.drawn_highlights:
+            changed = [self.highlights[idx] for idx in {self.drawn_highlights_index, self.highlights_index}
+                       if idx < len(self.highlights)]
+        else:
+            changed = self.drawn_highlights + self.highlights
+        self.damaged_rows |= self.highlight_rows(changed)
+
+    def draw_highlights(self, rows: set[int]) -> None:
+        if not self.highlights or self.pad_top is None:
             return
 
         formatting = curses.color_pair(1) | curses.A_BOLD
@@ -195,30 +298,31 @@ class Reader:
         for highlight_idx, data in enumerate(self.highlights):
             (row, col), other_lines = data
             for row_offset, chars_len in enumerate(other_lines):
+                if row + row_offset not in rows:
+                    continue
+                pad_row = row + row_offset - self.pad_top
                 # only on the first line start from `col`
                 # every other line should be from the start
                 start_col = 0 if row_offset else col
                 f = formatting_current if highlight_idx == self.highlights_index else formatting
-                self.pad.chgat(row + row_offset, start_col, chars_len, f)
+                self.pad.chgat(pad_row, start_col, chars_len, f)
 
     @staticmethod
     def action_noop(_: ueberzug.Canvas) -> None:
         pass
 
     def action_scroll_down(self, canvas: ueberzug.Canvas, step=1) -> None:
-        for _ in range(step):
-            if self.offset < self.chapter_rows - self.rows:
-                self.offset += 1
-                self.progress += 1
-        self.current_position = sum(self.word_count_per_line[:self.offset])
+        step = max(0, min(step, self.chapter_rows - self.rows - self.offset))
+        self.offset += step
+        self.progress += step
+        self.current_position = self.position_at(self.offset)
         self.redraw(canvas)
 
     def action_scroll_up(self, canvas: ueberzug.Canvas, step=1) -> None:
-        for _ in range(step):
-            if self.offset > 0:
-                self.offset -= 1
-                self.progress -= 1
-        self.current_position = sum(self.word_count_per_line[:self.offset])
+        step = max(0, min(step, self.offset))
+        self.offset -= step
+        self.progress -= step
+        self.current_position = self.position_at(self.offset)
         self.redraw(canvas)
 
     def action_scroll_to(self, canvas: ueberzug.Canvas, target=0) -> None:
@@ -246,11 +350,12 @@ class Reader:
         self.offset = self.chapter_rows - self.rows
         # add newly calculated offset for bottom of chapter
         self.progress += self.offset
-        self.current_position = sum(self.word_count_per_line[:self.offset])
+        self.current_position = self.position_at(self.offset)
         self.redraw(canvas)
 
     def action_next_chapter(self, canvas: ueberzug.Canvas) -> None:
         if self.book.next_chapter():
+            self.cancel_chapter_search()
             self.highlights = []
             self.highlights_index = 0
             self.positions[self.chapter_idx] = self.current_position
@@ -267,6 +372,7 @@ class Reader:
 
     def action_previous_chapter(self, canvas: ueberzug.Canvas) -> None:
         if self.book.previous_chapter():
+            self.cancel_chapter_search()
             self.highlights = []
             self.highlights_index = 0
             self.positions[self.chapter_idx] = self.current_position
@@ -284,9 +390,12 @@ class Reader:
     def action_open_toc(self, canvas: ueberzug.Canvas) -> None:
         self.hide_current_placements(canvas)
         action, chapter = self.toc.run(self.chapter_idx)
+        self.instrument.overlay_closed("open_toc")
+        self.invalidate()
         if action == "quit":
             self.action_quit(canvas)
         elif action == "select":
+            self.cancel_chapter_search()
             self.positions[self.chapter_idx] = self.current_position
             self.chapter_idx = chapter
             self.clear(canvas)
@@ -305,9 +414,12 @@ class Reader:
         self.hide_current_placements(canvas)
         position = self.chapter_idx, self.current_position
         action, bookmark = self.bookmarks.run(position)
+        self.instrument.overlay_closed("open_bookmarks")
+        self.invalidate()
         if action == "quit":
             self.action_quit(canvas)
         elif action == "select":
+            self.cancel_chapter_search()
             self.positions[self.chapter_idx] = self.current_position
             self.clear(canvas)
             self.chapter_idx, self.current_position = bookmark
@@ -327,6 +439,8 @@ class Reader:
     def action_open_cmd(self, canvas: ueberzug.Canvas, command="") -> None:
         self.hide_obstructing_placements(canvas)
         action, command = self.cmdline.run(command=command)
+        self.instrument.overlay_closed("open_cmd")
+        self.invalidate()
         # system commands:
         if action == "resize":
             self.action_resize(canvas)
@@ -337,80 +451,260 @@ class Reader:
             if label := " ".join(tokens[2:]):
                 position = self.chapter_idx, self.current_position
                 self.bookmarks.add_bookmark(label, position)
+        elif len(tokens) == 2 and tokens[0] == "set":
+            self.set_search_mode(tokens[1])
         # TODO: add indication for unkown command
         self.redraw(canvas)
     
+    def set_search_mode(self, mode: str) -> None:
+        enabled = not mode.startswith("no")
+        mode = mode.removeprefix("no")
+        if mode not in self.search_modes:
+            return
+        self.search_modes[mode] = enabled
+        self.cancel_chapter_search()
+        # the open search follows the new mode
+        if self.query:
+            self.search_chapters = self.book.search_book(self.query, self.search_modes["regex"])
+            self.highlights = self.search_current_chapter()
+            self.highlights_index = 0
+            self.highlight_query()
+
+    def search_current_chapter(self) -> list:
+        # an invalid regex matches nothing
+        try:
+            return self.book.highlight_query_in_current_chapter(self.query, **self.search_modes)
+        except ValueError:
+            return []
+
+    def first_highlight_from(self, row: int) -> int:
+        # index of the first highlight at or below `row`, wrapping around
+        idx = bisect_left([highlight_row for (highlight_row, _), _ in self.highlights], row)
+        return idx if idx < len(self.highlights) else 0
+
+    def search_as_typed(self, query: str) -> None:
+        # matched in the background, a stale match is cancelled
+        if self.search_job is not None:
+            self.search_job.cancel()
+            self.search_job = None
+        if not query:
+            self.highlights = []
+            self.highlights_index = 0
+            self.highlight_query()
+            self.paint_behind_cmdline()
+            return
+        try:
+            self.search_job = self.book.spawn_highlight_query(query, **self.search_modes)
+        except ValueError:
+            # an invalid regex (maybe not typed to the end yet) matches nothing
+            self.highlights = []
+            self.highlight_query()
+            self.paint_behind_cmdline()
+
+    def poll_search_job(self) -> str | None:
+        # the counter of the command line, updated once the matches are in
+        if self.search_job is not None:
+            if (highlights := self.search_job.result()) is None:
+                return None
+            self.search_job = None
+            self.highlights = highlights
+            self.highlights_index = self.first_highlight_from(self.offset)
+            self.highlight_query()
+            self.paint_behind_cmdline()
+        if not self.highlights:
+            return "0/0" if self.cmdline.command else ""
+        return f"{self.highlights_index + 1}/{len(self.highlights)}"
+
+    def paint_behind_cmdline(self) -> None:
+        # the highlights of the query being typed, above the command line
+        self.draw_viewport()
+        self.pad.noutrefresh(self.offset - self.pad_top, 0, 0, 0, self.rows - 2, self.cols - 1)
+        # the command line is only redrawn when its text changes
+        curses.doupdate()
+        self.painted_view = None
+
     def action_open_search(self, canvas: ueberzug.Canvas) -> None:
         self.hide_obstructing_placements(canvas)
-        # clear previous search, probably the slowest solution
-        action, self.query = self.cmdline.run(prompt="/")
+        self.cancel_chapter_search()
+        # the command line shows the matches while the query is typed
+        self.query = ""
+        action, query = self.cmdline.run(prompt="/", on_change=self.search_as_typed,
+                                         on_idle=self.poll_search_job)
+        self.instrument.overlay_closed("open_search")
+        if self.search_job is not None:
+            self.search_job.cancel()
+            self.search_job = None
+        self.query = query
+        self.invalidate()
         if action == "resize":
             self.action_resize(canvas)
             return
 
         if len(self.query) < 1:
-            self.redraw_text_formatting()
+            self.highlights = []
+            self.search_chapters = []
+            self.highlight_query()
             self.redraw(canvas)
             return
 
-        self.highlights = self.book.highlight_query_in_current_chapter(self.query)
-        self.highlights_index = 0
+        self.highlights = self.search_current_chapter()
+        self.highlights_index = self.first_highlight_from(self.offset)
+        self.search_chapters = self.book.search_book(self.query, self.search_modes["regex"])
         if not self.highlights:
+            # jumped to once found, see `poll_chapter_search`
+            self.search_other_chapters(1)
             self.highlight_query()
             self.redraw(canvas)
             return
         self.highlight_query()
         self.action_jump_to_highlight(canvas)
 
+    def search_other_chapters(self, direction: int) -> bool:
+        # look for matches in the other candidate chapters, nearest first
+        # in the direction of the search (wrapping around the book). they
+        # are laid out and searched in the background, the reader keeps
+        # going until `poll_chapter_search` gets the result.
+        num_chapters = self.book.get_num_chapters()
+        candidates = sorted(
+                (chapter for chapter in self.search_chapters if chapter != self.chapter_idx),
+                key=lambda chapter: (chapter - self.chapter_idx) * direction % num_chapters)
+        if not candidates:
+            return False
+        try:
+            job = self.book.spawn_search_chapters(candidates, self.query, **self.search_modes)
+        except ValueError:
+            # an invalid regex matches nothing
+            return False
+        self.chapter_search = job, direction
+        return True
+
+    def cancel_chapter_search(self) -> None:
+        # a search still pending would pull the reader back to its chapter
+        if self.chapter_search is not None:
+            self.chapter_search[0].cancel()
+            self.chapter_search = None
+
+    def poll_chapter_search(self, canvas: ueberzug.Canvas) -> None:
+        if self.chapter_search is None or not self.chapter_search[0].done:
+            return
+        job, direction = self.chapter_search
+        self.chapter_search = None
+        if (found := job.result()) is not None:
+            self.jump_to_search_chapter(canvas, direction, *found)
+        elif self.highlights:
+            # no other chapter has matches, wrap around this one
+            self.highlights_index = 0 if direction > 0 else len(self.highlights) - 1
+        else:
+            return
+        self.highlight_query()
+        self.action_jump_to_highlight(canvas)
+
+    def jump_to_search_chapter(self, canvas: ueberzug.Canvas, direction: int, chapter: int, highlights: list) -> None:
+        self.book.set_current_chapter(chapter)
+        self.highlights = highlights
+        self.highlights_index = 0 if direction > 0 else len(self.highlights) - 1
+        self.positions[self.chapter_idx] = self.current_position
+        self.chapter_idx = chapter
+        self.clear(canvas)
+        self.current_position = 0
+        self.render_chapter(canvas)
+        self.update_offset()
+        self.update_progress()
+
     def action_next_search(self, canvas: ueberzug.Canvas) -> None:
-        if not self.highlights:
+        if self.highlights and self.highlights_index + 1 < len(self.highlights):
+            self.highlights_index += 1
+        elif self.search_other_chapters(1):
+            # jumped to (or wrapped around) once searched, see `poll_chapter_search`
+            return
+        elif not self.highlights:
             return
-        # modulu add 1 to the index
-        self.highlights_index = (self.highlights_index + 1) % len(self.highlights)
+        else:
+            # no other chapter may have matches, wrap around this one
+            self.highlights_index = 0
         self.highlight_query()
         self.action_jump_to_highlight(canvas)
 
     def action_prev_search(self, canvas: ueberzug.Canvas) -> None:
-        if not self.highlights:
+        if self.highlights and self.highlights_index > 0:
+            self.highlights_index -= 1
+        elif self.search_other_chapters(-1):
+            # jumped to (or wrapped around) once searched, see `poll_chapter_search`
             return
-        # modulu add -1 to the index
-        self.highlights_index = (self.highlights_index - 1) % len(self.highlights)
+        elif not self.highlights:
+            return
+        else:
+            # no other chapter may have matches, wrap around this one
+            self.highlights_index = len(self.highlights) - 1
         self.highlight_query()
         self.action_jump_to_highlight(canvas)
 
-    def action_quit(self, _) -> None:
+    def save_state(self) -> None:
         self.positions[self.chapter_idx] = self.current_position
-        states = {}
-        if os.path.exists(self.state_file):
-            with open(self.state_file, "r") as state_file:
-                states = json.loads(state_file.read())
-
-        states[self.path] = {
-                "positions": self.positions,
-                "chapter_idx": self.chapter_idx,
-                "bookmarks": self.bookmarks.data,
-                }
+        self.state.save(self.path, self.chapter_idx, self.positions, self.bookmarks.data)
+        self.last_save = time.monotonic()
+
+    def autosave(self) -> None:
+        # a crash loses at most `autosave_interval` seconds of reading
+        if time.monotonic() - self.last_save >= self.autosave_interval:
+            self.save_state()
 
-        with open(self.state_file, "w") as state_file:
-            state_file.write(json.dumps(states))
+    def action_quit(self, _) -> None:
+        self.save_state()
+        self.instrument.dump(os.path.join(self.cache_dir, "timings"), self.book.timings())
         curses.endwin()
         exit(0)
 
     def action_resize(self, canvas: ueberzug.Canvas) -> None:
+        # the matches found are laid out for the old size
+        self.cancel_chapter_search()
         self.clear(canvas)
         self.book.update_term_info()
+        old_cols = self.cols
         self.rows, self.cols = self.stdscr.getmaxyx()
-        self.lines = self.book.number_of_lines()
+        # only the current chapter is laid out right away. the other chapters
+        # are counted in the background (cancelling the count of an earlier
+        # resize), until then their lines are estimated from the old width.
+        self.lines_job = self.book.spawn_number_of_lines()
+        if (lines := self.lines_job.result()) is not None:
+            self.lines_job = None
+            self.set_lines(lines)
+        else:
+            self.set_lines([max(1, lines * old_cols // self.cols) for lines in self.lines], estimated=True)
         self.update_progress()
         self.render_chapter(canvas)
         self.update_offset()
-        self.highlights = self.book.highlight_query_in_current_chapter(self.query)
+        self.highlights = self.search_current_chapter()
         self.highlight_query()
         self.redraw(canvas)
 
-    def on_key(self, key: int, canvas: ueberzug.Canvas) -> None:
+    def on_key(self, key: int, canvas: ueberzug.Canvas, count: int = 1) -> None:
+        action = self.keys.get(key, self.action_noop)
+        # timed from here until the result is painted
+        self.instrument.key_pressed(action.__name__.removeprefix("action_"))
+        if action.__name__ in STEP_ACTIONS:
+            action(canvas, step=count)
+        else:
+            for _ in range(count):
+                action(canvas)
+        if not self.needs_paint:
+            self.instrument.discard()
+
+    def read_keys(self, key: int) -> tuple[int, int]:
+        # (key, count) of `key` and the presses of it already waiting, only
+        # for the step actions. any other key is left waiting: it may open a
+        # prompt or a list, which has to get the keys typed after it.
         action = self.keys.get(key, self.action_noop)
-        action(canvas)
+        if action.__name__ not in STEP_ACTIONS:
+            return key, 1
+        count = 1
+        self.pad.timeout(0)
+        while (next_key := self.pad.getch()) != -1:
+            if next_key != key:
+                curses.ungetch(next_key)
+                break
+            count += 1
+        return key, count
 
     def clear(self, canvas: ueberzug.Canvas) -> None:
         try:
@@ -418,67 +712,119 @@ class Reader:
             self.percentage_win.clear()
             if self.highlights_win:
                 self.highlights_win.clear()
-            with canvas.synchronous_lazy_drawing:
-                for _, placement in self.current_chapter_placements:
-                    placement.visibility = ueberzug.Visibility.INVISIBLE
-            self.current_chapter_placements = []
+            self.placements.clear(canvas)
         except AttributeError:
             pass
 
     def hide_current_placements(self, canvas: ueberzug.Canvas) -> None:
-        with canvas.synchronous_lazy_drawing:
-            for _, placement in self.current_chapter_placements:
-                placement.visibility = ueberzug.Visibility.INVISIBLE
+        self.placements.hide(canvas)
 
     def hide_obstructing_placements(self, canvas: ueberzug.Canvas) -> None:
-        with canvas.lazy_drawing:
-            for _, placement in self.current_chapter_placements:
-                if placement.y + placement.height + 1 >= self.rows:
-                    placement.visibility = ueberzug.Visibility.INVISIBLE;
+        self.placements.hide(canvas, lambda placement: placement.y + placement.height + 1 >= self.rows)
+
+    def invalidate(self) -> None:
+        # everything is painted again on the next paint, e.g. after an overlay
+        self.painted_view = None
+        self.painted_percentage = None
+        self.painted_counter = None
 
     def hide_highlights_counter_window(self) -> None:
         if self.highlights_win:
             del self.highlights_win
             self.highlights_win = None
 
-    def redraw(self, canvas: ueberzug.Canvas) -> None:
+    def redraw(self, _: ueberzug.Canvas | None = None) -> None:
+        # the screen is painted by `loop`, once per frame at most
+        self.needs_paint = True
+
+    def paint(self, canvas: ueberzug.Canvas) -> None:
+        self.needs_paint = False
+        self.last_paint = time.monotonic()
         if self.offset > (offset := self.chapter_rows - self.rows):
             self.offset = offset
-        self.pad.refresh(self.offset, 0, 0, 0, self.rows - 1, self.cols - 1)
+        self.draw_viewport()
 
-        if (lines_sum := sum(self.lines)) <= 0:
+        if (lines_sum := self.lines_prefix[-1]) <= 0:
           percentage_str = "100%"
+        elif self.lines_estimated:
+          percentage_str = f"~{min(99, self.progress * 100 // lines_sum)}%"
         else:
           percentage_str = f"{self.progress * 100 // lines_sum}%"
 
-        self.percentage_win.addstr(0, 4 - len(percentage_str), percentage_str, curses.A_BOLD)
-        self.percentage_win.refresh()
-
-        if not self.query:
-            self.hide_highlights_counter_window()
-        else:
+        highlights_str = None
+        if self.query:
             # calculate the human legible index
             highlight_index = self.highlights_index + 1 if self.highlights else 0
             highlights_str = f"{highlight_index}/{len(self.highlights)}"
-            win_y = self.rows - 1
-            win_x = self.cols - len(highlights_str)
-            self.highlights_win = curses.newwin(1, len(highlights_str) + 1, win_y, win_x)
+
+        # only what changed since the last paint is repainted. the status
+        # windows sit on top of the pad, repainting the pad covers them.
+        view = (self.offset, self.pad_top)
+        counter_moved = self.painted_counter is not None \
+            and (highlights_str is None or len(highlights_str) != len(self.painted_counter))
+        pad_damaged = self.pad_dirty or view != self.painted_view or counter_moved
+        if pad_damaged:
+            with self.instrument.stage("refresh"):
+                self.pad.touchwin()
+                self.pad.noutrefresh(self.offset - self.pad_top, 0, 0, 0, self.rows - 1, self.cols - 1)
+            self.painted_view = view
+            self.pad_dirty = False
+
+        if pad_damaged or percentage_str != self.painted_percentage:
+            self.percentage_win.erase()
+            self.percentage_win.addstr(0, 4 - len(percentage_str), percentage_str, curses.A_BOLD)
+            self.percentage_win.noutrefresh()
+            self.painted_percentage = percentage_str
+
+        if highlights_str is None:
+            self.hide_highlights_counter_window()
+        elif pad_damaged or highlights_str != self.painted_counter:
+            width = len(highlights_str) + 1
+            if self.highlights_win is None or self.highlights_win.getmaxyx()[1] != width:
+                self.hide_highlights_counter_window()
+                self.highlights_win = curses.newwin(1, width, self.rows - 1, self.cols - len(highlights_str))
+            self.highlights_win.erase()
             self.highlights_win.addstr(0, 0, highlights_str, curses.A_BOLD | curses.A_REVERSE)
-            self.highlights_win.refresh()
+            self.highlights_win.noutrefresh()
+        self.painted_counter = highlights_str
+        curses.doupdate()
+
+        with self.instrument.stage("ueberzug"):
+            self.placements.show(canvas, self.offset, self.rows)
+        self.instrument.painted()
 
-        with canvas.synchronous_lazy_drawing:
-            for initial_y, placement in self.current_chapter_placements:
-                visibility = self.determine_visibility(initial_y, placement.height)
-                if visibility == ueberzug.Visibility.VISIBLE:
-                    placement.y = initial_y - self.offset
-                placement.visibility = visibility
+    def loop(self) -> None:
+        if self.text_only:
+            self.run(None)
+            return
+        import ueberzug.lib.v0 as ueberzug
+        with ueberzug.Canvas() as canvas:
+            self.run(canvas)
 
-    @ueberzug.Canvas()
-    def loop(self, canvas: ueberzug.Canvas) -> None:
+    def run(self, canvas: ueberzug.Canvas | None) -> None:
         self.render_chapter(canvas)
         self.update_offset()
         self.update_progress()
         self.redraw(canvas)
         while True:
+            if self.needs_paint:
+                if (wait := self.last_paint + 1 / FRAME_RATE - time.monotonic()) <= 0:
+                    self.paint(canvas)
+                    continue
+                # keys pressed until the next frame are handled before painting it
+                self.pad.timeout(max(1, int(wait * 1000)))
+            elif self.chapter_search is not None:
+                self.pad.timeout(CHAPTER_SEARCH_POLL)
+            else:
+                self.pad.timeout(-1 if self.lines_job is None else LINES_JOB_POLL)
             ch = self.pad.getch()
-            self.on_key(ch, canvas)
+            if ch == -1:
+                if not self.needs_paint:
+                    self.poll_lines_job()
+                    self.poll_chapter_search(canvas)
+                continue
+            # held (auto repeated) keys are merged, so the screen never lags
+            # behind the keyboard with a backlog of single steps.
+            key, count = self.read_keys(ch)
+            self.on_key(key, canvas, count)
+            self.autosave()
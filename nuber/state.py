@@ -0,0 +1,55 @@
+import json
+import os
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    path TEXT PRIMARY KEY,
+    chapter_idx INTEGER NOT NULL,
+    positions TEXT NOT NULL,
+    bookmarks TEXT NOT NULL
+)
+"""
+
+
+# reading state of every book, one row per book in <cache_dir>/state.db.
+# saving a book writes its row alone, in a transaction, so the cost does not
+# grow with the library and a crash mid-write leaves the previous state intact.
+class StateStore:
+    def __init__(self, cache_dir: str) -> None:
+        self.db = sqlite3.connect(os.path.join(cache_dir, "state.db"))
+        self.db.execute("PRAGMA journal_mode=WAL")
+        with self.db:
+            self.db.execute(SCHEMA)
+        self.migrate(os.path.join(cache_dir, "state.json"))
+
+    def migrate(self, json_path: str) -> None:
+        # state.json held the state of every book in a single json object
+        if not os.path.exists(json_path):
+            return
+        with open(json_path, "r") as state_file:
+            states = json.loads(state_file.read())
+        with self.db:
+            for path, state in states.items():
+                self.db.execute(
+                        "INSERT OR IGNORE INTO books VALUES (?, ?, ?, ?)",
+                        (path, state["chapter_idx"], json.dumps(state["positions"]), json.dumps(state["bookmarks"])))
+        os.replace(json_path, f"{json_path}.migrated")
+
+    def load(self, path: str) -> dict | None:
+        row = self.db.execute(
+                "SELECT chapter_idx, positions, bookmarks FROM books WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        chapter_idx, positions, bookmarks = row
+        return {
+                "chapter_idx": chapter_idx,
+                "positions": json.loads(positions),
+                "bookmarks": [(label, tuple(position)) for label, position in json.loads(bookmarks)],
+                }
+
+    def save(self, path: str, chapter_idx: int, positions: list[int], bookmarks: list) -> None:
+        with self.db:
+            self.db.execute(
+                    "INSERT OR REPLACE INTO books VALUES (?, ?, ?, ?)",
+                    (path, chapter_idx, json.dumps(positions), json.dumps(bookmarks)))
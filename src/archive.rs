@@ -0,0 +1,115 @@
+use epub::doc::EpubDoc;
+use memmap2::Mmap;
+use std::collections::VecDeque;
+use std::fs::File;
+use std::io::{self, Cursor};
+use std::path::{Path, PathBuf};
+use std::sync::{Arc, Mutex};
+
+// the epub file mapped into memory, shared by every handle on it
+#[derive(Clone)]
+pub struct Mapped(Arc<Mmap>);
+
+impl AsRef<[u8]> for Mapped {
+    fn as_ref(&self) -> &[u8] {
+        &self.0
+    }
+}
+
+// a handle on the mapped epub. reading through it is a copy out of memory
+// (and the inflating of the entry), without any file I/O of its own.
+pub type Epub = EpubDoc<Cursor<Mapped>>;
+
+// default memory budget of the decompressed chapters kept around
+const CHAPTER_BYTES: usize = 64 * 1024 * 1024;
+
+// the decompressed chapters, from the least to the most recently used
+struct ChapterBytes {
+    budget: usize,
+    size: usize,
+    entries: VecDeque<(usize, Arc<str>)>,
+}
+
+impl ChapterBytes {
+    fn get(&mut self, chapter: usize) -> Option<Arc<str>> {
+        let idx = self.entries.iter().position(|(c, _)| *c == chapter)?;
+        let entry = self.entries.remove(idx)?;
+        let html = entry.1.clone();
+        self.entries.push_back(entry);
+        Some(html)
+    }
+
+    fn insert(&mut self, chapter: usize, html: Arc<str>) {
+        if self.entries.iter().any(|(c, _)| *c == chapter) {
+            return;
+        }
+        self.size += html.len();
+        self.entries.push_back((chapter, html));
+        while self.size > self.budget {
+            match self.entries.pop_front() {
+                Some((_, evicted)) => self.size -= evicted.len(),
+                None => break,
+            }
+        }
+    }
+}
+
+// an epub mapped into memory once, with the path of every spine item looked
+// up up front and the chapters kept decompressed (up to a budget), so passes
+// over the whole book and jumps around it inflate every chapter only once.
+// handles for other threads are opened on the same mapping, see `open`.
+pub struct Archive {
+    mapped: Mapped,
+    // path inside the archive of every chapter (spine item)
+    spine: Vec<Option<PathBuf>>,
+    chapters: Mutex<ChapterBytes>,
+}
+
+impl Archive {
+    // the archive of the epub at `path`, and a first handle on it
+    pub fn map(path: &Path) -> io::Result<(Archive, Epub)> {
+        let file = File::open(path)?;
+        // the epub is only ever read, a file changed under the mapping is
+        // as broken as a file changed under a reader.
+        let mmap = unsafe { Mmap::map(&file)? };
+        let mapped = Mapped(Arc::new(mmap));
+        let epub = EpubDoc::from_reader(Cursor::new(mapped.clone()))
+            .map_err(|err| io::Error::new(io::ErrorKind::InvalidData, err.to_string()))?;
+        let spine = epub
+            .spine
+            .iter()
+            .map(|id| epub.resources.get(id).map(|(path, _)| path.clone()))
+            .collect();
+        let archive = Archive {
+            mapped,
+            spine,
+            chapters: Mutex::new(ChapterBytes {
+                budget: CHAPTER_BYTES,
+                size: 0,
+                entries: VecDeque::new(),
+            }),
+        };
+        Ok((archive, epub))
+    }
+
+    // another handle on the mapped epub
+    pub fn open(&self) -> Option<Epub> {
+        EpubDoc::from_reader(Cursor::new(self.mapped.clone())).ok()
+    }
+
+    pub fn len(&self) -> usize {
+        self.spine.len()
+    }
+
+    // the html of `chapter`, inflated through `epub` unless it is kept
+    pub fn chapter(&self, epub: &mut Epub, chapter: usize) -> Option<Arc<str>> {
+        if let Some(html) = self.chapters.lock().unwrap().get(chapter) {
+            return Some(html);
+        }
+        let path = self.spine.get(chapter)?.as_ref()?;
+        let data = epub.get_resource_by_path(path).ok()?;
+        let html: Arc<str> = Arc::from(String::from_utf8(data).ok()?);
+        self.chapters.lock().unwrap().insert(chapter, html.clone());
+        Some(html)
+    }
+}
@@ -1,56 +1,132 @@
-use crate::deunicode::Deunicode;
-use crate::parser::{Converter, Decorator, Element, RichConverter, Style};
+use crate::archive::{Archive, Epub};
+use crate::cache::{book_hash, ChapterCache, LayoutCache};
+use crate::doc::Doc;
+use crate::image::ImageStore;
+use crate::layout;
+use crate::parser::{Decorator, Element};
+use crate::relayout::LinesJob;
+use crate::search::{
+    doc_text, ChapterText, Highlight, LinesLengths, Matcher, SearchIndex, SearchOptions,
+};
+use crate::search_job::{ChapterSearchJob, SearchJob};
+use crate::timings::{Timer, Timings};
+use crate::view::ChapterView;
+use crate::worker::{Job, Worker};
 use epub::doc::EpubDoc;
-use html2text::parse;
-use html2text::render::text_renderer::TaggedLineElement;
 use libc::{c_ushort, ioctl, STDOUT_FILENO, TIOCGWINSZ};
+use pyo3::exceptions::PyValueError;
 use pyo3::prelude::*;
-use std::fs::{write, File};
-use std::io::BufReader;
+use std::collections::{BTreeMap, HashMap, VecDeque};
+use std::io::{Read, Seek};
 use std::mem;
-use tempfile::{tempdir, TempDir};
+use std::path::Path;
+use std::sync::{Arc, Mutex};
 
 #[pyclass]
-#[derive(Copy, Clone)]
+#[derive(Copy, Clone, PartialEq, Eq, Hash)]
 pub struct TermSize {
+    #[pyo3(get)]
     pub row: c_ushort,
+    #[pyo3(get)]
     pub col: c_ushort,
+    #[pyo3(get)]
     pub x: c_ushort,
+    #[pyo3(get)]
     pub y: c_ushort,
 }
 
+// the size of a terminal in cells (row, col) and pixels (x, y).
+// constructed from python to use a book without a terminal, e.g. in benchmarks.
+#[pymethods]
+impl TermSize {
+    #[new]
+    fn new(row: c_ushort, col: c_ushort, x: c_ushort, y: c_ushort) -> Self {
+        TermSize { row, col, x, y }
+    }
+}
+
+impl TermSize {
+    // names the files cached for this geometry
+    pub fn dir_name(&self) -> String {
+        format!("{}x{}-{}x{}", self.col, self.row, self.x, self.y)
+    }
+}
+
 #[pyclass]
 pub struct Book {
-    book: EpubDoc<BufReader<File>>,
-    temp_dir: TempDir,
+    archive: Arc<Archive>,
+    book: Epub,
+    images: Arc<ImageStore>,
+    worker: Worker,
     term_info: TermSize,
+    layout_cache: LayoutCache,
+    chapters: Arc<Mutex<ChapterCache>>,
+    search_index: Arc<Mutex<Option<SearchIndex>>>,
+    timings: Arc<Timings>,
+    lines_job: Option<LinesJob>,
+    // searchable text of the recently searched chapters
+    search_texts: Arc<Mutex<SearchTexts>>,
+    search_job: Option<SearchJob>,
+    chapter_search_job: Option<ChapterSearchJob>,
 }
 
-type Head = (usize, usize);
-type LinesLengths = Vec<usize>;
-type Highlight = (Head, LinesLengths);
+// default memory budget of the rendered chapters kept around
+const CHAPTER_CACHE_SIZE: usize = 64 * 1024 * 1024;
+
+// number of chapters whose searchable text is kept around
+const SEARCH_TEXTS: usize = 32;
+
+// ordered from the least to the most recently searched
+type SearchTexts = VecDeque<((usize, TermSize), Arc<ChapterText>)>;
 
 #[pymethods]
 impl Book {
+    // the terminal size is read from stdout unless `term_size` is given.
+    // in `text_only` mode images are left out, with a placeholder in their place.
     #[new]
-    fn new(path: String) -> Self {
-        let temp_dir = tempdir().unwrap();
-        let term_info = Self::get_term_info();
-        let mut book = EpubDoc::new(path).unwrap();
-
-        for (_, (path, mime)) in book.resources.clone() {
-            if mime.contains("image") {
-                let fname = path.file_name().unwrap();
-                let image_data = book.get_resource_by_path(path.clone()).unwrap();
-                write(temp_dir.path().join(fname), image_data).unwrap();
-            }
-        }
+    #[args(term_size = "None", text_only = "false")]
+    fn new(path: String, cache_dir: String, term_size: Option<TermSize>, text_only: bool) -> Self {
+        let cache_dir = Path::new(&cache_dir);
+        let term_info = term_size.unwrap_or_else(Self::get_term_info);
+        let hash = book_hash(cache_dir, Path::new(&path)).unwrap();
+        let layout_cache = LayoutCache::new(cache_dir, &hash, text_only);
+        let (archive, book) = Archive::map(Path::new(&path)).unwrap();
+        let archive = Arc::new(archive);
+        // nothing is extracted up front, chapters write the images they
+        // reference when rendered and the worker does so for their neighbours.
+        let images_dir = cache_dir.join("images").join(&hash);
+        let images = Arc::new(if text_only {
+            ImageStore::disabled(images_dir)
+        } else {
+            ImageStore::new(images_dir, &book)
+        });
+        let chapters = Arc::new(Mutex::new(ChapterCache::new(CHAPTER_CACHE_SIZE)));
+        let index_path = cache_dir.join("search").join(format!("{}.json", hash));
+        let search_index = SearchIndex::load_or_spawn(archive.clone(), index_path);
+        let worker = Worker::spawn(
+            archive.clone(),
+            images.clone(),
+            layout_cache.clone(),
+            chapters.clone(),
+        );
 
-        Book {
+        let book = Book {
+            archive,
             book,
-            temp_dir,
+            images,
+            worker,
             term_info,
-        }
+            layout_cache,
+            chapters,
+            search_index,
+            timings: Arc::new(Timings::default()),
+            lines_job: None,
+            search_texts: Arc::new(Mutex::new(VecDeque::new())),
+            search_job: None,
+            chapter_search_job: None,
+        };
+        book.use_geometry();
+        book
     }
 
     #[staticmethod]
@@ -64,6 +140,12 @@ impl Book {
 
     fn update_term_info(&mut self) {
         self.term_info = Self::get_term_info();
+        self.use_geometry();
+    }
+
+    fn set_term_info(&mut self, term_size: TermSize) {
+        self.term_info = term_size;
+        self.use_geometry();
     }
 
     fn next_chapter(&mut self) -> bool {
@@ -75,7 +157,11 @@ impl Book {
     }
 
     fn get_current_str(&mut self) -> String {
-        self.book.get_current_str().unwrap()
+        let chapter = self.book.get_current_page();
+        self.archive
+            .chapter(&mut self.book, chapter)
+            .map(|html| html.to_string())
+            .unwrap_or_default()
     }
 
     fn set_current_chapter(&mut self, chapter: usize) -> bool {
@@ -87,154 +173,269 @@ impl Book {
     }
 
     fn get_toc(&mut self) -> Vec<(String, usize)> {
-        self.book
-            .toc
-            .iter()
-            .map(|p| {
-                (
-                    p.label.clone(),
-                    self.book.resource_uri_to_chapter(&p.content),
-                )
-            })
-            .filter(|(_, n)| n.is_some())
-            .map(|(l, n)| (l, n.unwrap()))
-            .collect()
-    }
-
-    fn number_of_lines(&mut self) -> Vec<usize> {
-        let current_chapter = self.book.get_current_page();
-        self.set_current_chapter(0);
-
-        let temp_dir = self.temp_dir.path().to_owned();
-        let decorator = Decorator::new(temp_dir.as_path(), self.term_info);
-
-        let mut number_of_lines = Vec::new();
-
-        // iterate over all of the chapters and sum up the lines
-        while self.next_chapter() {
-            let render_tree = parse(self.get_current_str().as_bytes());
-            let lines = render_tree
-                .render(self.term_info.col as usize, decorator)
-                .into_lines();
-            number_of_lines.push(lines.len());
+        toc(&self.book)
+    }
+
+    fn number_of_lines(&mut self, py: Python) -> Vec<usize> {
+        let _timer = Timer::start(&self.timings, "number_of_lines");
+        if let Some(number_of_lines) = self.layout_cache.load_number_of_lines(self.term_info) {
+            return number_of_lines;
         }
-        self.set_current_chapter(current_chapter);
+
+        // the archive can only be read from one thread, so the chapters
+        // (and the dimensions of the images in them) are read up front.
+        let mut chapters = Vec::new();
+        for chapter in 1..self.archive.len() {
+            let html = self
+                .archive
+                .chapter(&mut self.book, chapter)
+                .unwrap_or_else(|| Arc::from(""));
+            self.images.probe(&html, &mut self.book);
+            chapters.push(html);
+        }
+
+        let images = &self.images;
+        let term_info = self.term_info;
+        let number_of_lines =
+            py.allow_threads(|| layout::number_of_lines(&chapters, images, term_info));
+        self.layout_cache
+            .store_number_of_lines(self.term_info, &number_of_lines);
         number_of_lines
     }
 
+    // `number_of_lines` for the current terminal size, counted in the
+    // background. the job started before (for an older size) is cancelled.
+    fn spawn_number_of_lines(&mut self) -> LinesJob {
+        if let Some(job) = self.lines_job.take() {
+            job.cancel();
+        }
+        let job = LinesJob::spawn(
+            self.archive.clone(),
+            self.get_num_chapters().saturating_sub(1),
+            self.images.clone(),
+            self.layout_cache.clone(),
+            self.term_info,
+        );
+        self.lines_job = Some(job.share());
+        job
+    }
+
     // returns single string with pure text and line lengths
     // TODO: rename function
     fn render_current_chapter_text(&mut self) -> (String, LinesLengths) {
-        let mut lines_len = Vec::new();
-        let mut text = String::new();
-        let temp_dir = self.temp_dir.path().to_owned();
-        let decorator = Decorator::new(temp_dir.as_path(), self.term_info);
-        let render_tree = parse(self.get_current_str().as_bytes());
-        let lines = render_tree
-            .render(self.term_info.col as usize, decorator)
-            .into_lines();
-
-        for line in lines {
-            let mut line_str = String::new();
-            for element in line.iter() {
-                if let TaggedLineElement::Str(ts) = element {
-                    line_str.push_str(&ts.s.clone());
-                }
-            }
-            let line = line_str.trim_end();
-            let line_len = line.chars().count();
-            text.push_str(line);
-            text.push(' ');
-            lines_len.push(line_len + 1);
-        }
-        (text, lines_len)
+        // the text of a line is exactly the text of its elements,
+        // so the (possibly cached) rendered chapter is reused here.
+        doc_text(&self.current_chapter_doc())
     }
 
-    fn highlight_query_in_current_chapter(&mut self, query: String) -> Vec<Highlight> {
-        let mut matches = Vec::new();
+    // raises ValueError for an invalid regex
+    #[args(regex = "false", whole_word = "false", smart_case = "false")]
+    fn highlight_query_in_current_chapter(
+        &mut self,
+        query: String,
+        regex: bool,
+        whole_word: bool,
+        smart_case: bool,
+    ) -> PyResult<Vec<Highlight>> {
+        let _timer = Timer::start(&self.timings, "highlight_query_in_current_chapter");
         if query.is_empty() {
-            return matches;
+            return Ok(Vec::new());
         }
-        let (text, lines_len) = self.render_current_chapter_text();
-        let deunicoded_text = Deunicode::from(text.as_str());
-        for range in deunicoded_text.match_indices(|s| s.to_lowercase(), query) {
-            let start = range.start;
-            let mut col_idx = range.start;
-            let mut row_idx = 0;
-            for (idx, line_len) in lines_len.clone().into_iter().enumerate() {
-                if col_idx < line_len {
-                    row_idx = idx;
-                    break;
-                }
-                col_idx -= line_len;
-            }
-            let first_char = (row_idx, col_idx);
-            let mut query_len = range.end - start;
-            // create a vec of following lines after the first match
-            // each index is the next line with the
-            // specified number of characters to highlight.
-            // the highlight in the first line starts from `col_idx`
-            // in the rest (if exist) of the lines - start from 0.
-            let mut lines_len_iter = lines_len.clone().into_iter().skip(row_idx);
-            let first_line_len = lines_len_iter.next().unwrap();
-            // because the first line is special, we will treat it
-            // first and then iterate over the rest.
-            let first_highlight = query_len.min(first_line_len - col_idx);
-            let mut highlights = Vec::from([first_highlight]);
-            // subtract the amount of chars we pushed into `highlights`
-            query_len = query_len.saturating_sub(first_highlight);
-            // iterate over the rest of the lines
-            for line_len in lines_len_iter {
-                // if the rest of the highlight can fit into the line
-                // we do so and stop iterating. we're done.
-                if line_len >= query_len {
-                    highlights.push(query_len);
-                    break;
-                }
-                // otherwise, we just enter the line_len and subtract
-                highlights.push(line_len);
-                query_len = query_len.saturating_sub(line_len);
-            }
-            matches.push((first_char, highlights));
+        let matcher = matcher(&query, regex, whole_word, smart_case)?;
+        Ok(self.current_chapter_text().highlights(&matcher))
+    }
+
+    // `highlight_query_in_current_chapter` matched in the background, for
+    // searching as the query is typed. the job started before is cancelled.
+    // raises ValueError for an invalid regex
+    #[args(regex = "false", whole_word = "false", smart_case = "false")]
+    fn spawn_highlight_query(
+        &mut self,
+        query: String,
+        regex: bool,
+        whole_word: bool,
+        smart_case: bool,
+    ) -> PyResult<SearchJob> {
+        if let Some(job) = self.search_job.take() {
+            job.cancel();
         }
-        matches
+        let matcher = matcher(&query, regex, whole_word, smart_case)?;
+        // the text is built on the job's thread, only the (usually cached)
+        // layout is looked up here.
+        let key = (self.book.get_current_page(), self.term_info);
+        let doc = self.current_chapter_doc();
+        let search_texts = self.search_texts.clone();
+        let job = SearchJob::spawn(move || chapter_text(&search_texts, key, &doc), matcher);
+        self.search_job = Some(job.share());
+        Ok(job)
+    }
+
+    // chapters which may hold matches of `query`, to be confirmed with
+    // `highlight_query_in_current_chapter`. until the index is built
+    // (and for regular expressions) every chapter is a candidate.
+    #[args(regex = "false")]
+    fn search_book(&mut self, query: String, regex: bool) -> Vec<usize> {
+        let _timer = Timer::start(&self.timings, "search_book");
+        let candidates = match self.search_index.lock().unwrap().as_ref() {
+            Some(index) if !regex => index.chapters(&query),
+            _ => None,
+        };
+        candidates.unwrap_or_else(|| (0..self.get_num_chapters()).collect())
+    }
+
+    // the first of `chapters` (in order) with matches of `query`, looked for
+    // in the background. the job started before is cancelled.
+    // raises ValueError for an invalid regex
+    #[args(regex = "false", whole_word = "false", smart_case = "false")]
+    fn spawn_search_chapters(
+        &mut self,
+        chapters: Vec<usize>,
+        query: String,
+        regex: bool,
+        whole_word: bool,
+        smart_case: bool,
+    ) -> PyResult<ChapterSearchJob> {
+        if let Some(job) = self.chapter_search_job.take() {
+            job.cancel();
+        }
+        let matcher = matcher(&query, regex, whole_word, smart_case)?;
+        let job = ChapterSearchJob::spawn(
+            self.archive.clone(),
+            chapters,
+            self.images.clone(),
+            self.layout_cache.clone(),
+            self.chapters.clone(),
+            self.term_info,
+            matcher,
+        );
+        self.chapter_search_job = Some(job.share());
+        Ok(job)
     }
 
     fn render_current_chapter(&mut self) -> Vec<Vec<Element>> {
-        let mut doc = Vec::new();
-        let rich_converter = RichConverter;
-        let temp_dir = self.temp_dir.path().to_owned();
-        let decorator = Decorator::new(temp_dir.as_path(), self.term_info);
-        let render_tree = parse(self.get_current_str().as_bytes());
-        let lines = render_tree
-            .render(self.term_info.col as usize, decorator)
-            .into_lines();
-
-        for line in lines {
-            let mut elements = Vec::new();
-            for element in line.iter() {
-                if let TaggedLineElement::Str(ts) = element {
-                    let styles: Vec<_> = ts
-                        .tag
-                        .iter()
-                        .filter_map(|a| rich_converter.get_style(a))
-                        .collect();
-                    let link_target = ts
-                        .tag
-                        .iter()
-                        .find_map(|a| rich_converter.get_link(a))
-                        .map(ToOwned::to_owned);
-                    let image_info = ts.tag.iter().find_map(|a| decorator.get_image_info(a));
-                    elements.push(Element::new(
-                        ts.s.clone(),
-                        Style::merge(&styles),
-                        link_target,
-                        image_info,
-                    ));
-                }
-            }
-            doc.push(elements);
+        let _timer = Timer::start(&self.timings, "render_current_chapter");
+        let doc = self.current_chapter_doc();
+        self.prefetch_neighbours();
+        (0..doc.len()).map(|row| doc.elements(row)).collect()
+    }
+
+    // like `render_current_chapter`, but the lines stay in the chapter,
+    // python reads the rows it draws through the view.
+    fn view_current_chapter(&mut self) -> ChapterView {
+        let _timer = Timer::start(&self.timings, "view_current_chapter");
+        let doc = self.current_chapter_doc();
+        self.prefetch_neighbours();
+        ChapterView::new(doc)
+    }
+
+    fn set_chapter_cache_size(&mut self, size: usize) {
+        self.chapters.lock().unwrap().set_budget(size);
+    }
+
+    fn enable_timings(&self) {
+        self.timings.enable();
+    }
+
+    // latency histograms (upper bound in us -> count) of the book's stages
+    fn timings(&self) -> HashMap<String, BTreeMap<u64, u64>> {
+        self.timings.histograms()
+    }
+}
+
+impl Book {
+    // keeps the layout (and downscaled images) of the last few terminal
+    // sizes only, a resized terminal would otherwise grow the cache forever.
+    fn use_geometry(&self) {
+        for geometry in self.layout_cache.use_geometry(self.term_info) {
+            self.images.evict_scaled(&geometry);
+        }
+    }
+
+    // have the neighbours ready by the time the reader flips to them
+    fn prefetch_neighbours(&self) {
+        let chapter = self.book.get_current_page();
+        self.worker.submit(Job::Render(chapter + 1, self.term_info));
+        if chapter > 0 {
+            self.worker.submit(Job::Render(chapter - 1, self.term_info));
         }
+    }
+
+    // the rendered current chapter, looked up in memory, then on disk,
+    // and only rendered when neither has it.
+    fn current_chapter_doc(&mut self) -> Arc<Doc> {
+        let chapter = self.book.get_current_page();
+        let key = (chapter, self.term_info);
+        if let Some(doc) = self.chapters.lock().unwrap().get(&key) {
+            return doc;
+        }
+
+        let images = self.images.clone();
+        let decorator = Decorator::new(&images, self.term_info);
+        let html = self.get_current_str();
+        // the layout (cached or not) needs the dimensions of the images,
+        // the images themselves are written by the worker.
+        images.probe(&html, &mut self.book);
+        let timer = Timer::start(&self.timings, "layout");
+        let doc = self.layout_cache.load_or_render(chapter, &html, decorator);
+        drop(timer);
+        let doc = Arc::new(doc);
+        self.chapters.lock().unwrap().insert(key, doc.clone());
+        self.worker.submit(Job::Scale(chapter, doc.clone()));
         doc
     }
+
+    // the searchable text of the current chapter, kept for the chapters
+    // searched last
+    fn current_chapter_text(&mut self) -> Arc<ChapterText> {
+        let key = (self.book.get_current_page(), self.term_info);
+        let doc = self.current_chapter_doc();
+        chapter_text(&self.search_texts, key, &doc)
+    }
+}
+
+// the searchable text of a rendered chapter, built unless kept in `texts`,
+// which evicts the least recently searched one once full. the text is
+// built without holding the lock, a search job may be doing the same.
+fn chapter_text(texts: &Mutex<SearchTexts>, key: (usize, TermSize), doc: &Doc) -> Arc<ChapterText> {
+    if let Some(text) = recently_searched(&mut texts.lock().unwrap(), key) {
+        return text;
+    }
+    let text = Arc::new(ChapterText::from_doc(doc));
+    let mut texts = texts.lock().unwrap();
+    if let Some(text) = recently_searched(&mut texts, key) {
+        return text;
+    }
+    if texts.len() >= SEARCH_TEXTS {
+        texts.pop_front();
+    }
+    texts.push_back((key, text.clone()));
+    text
+}
+
+// the kept text of `key`, moved to the most recently searched end
+fn recently_searched(texts: &mut SearchTexts, key: (usize, TermSize)) -> Option<Arc<ChapterText>> {
+    let idx = texts.iter().position(|(k, _)| *k == key)?;
+    let entry = texts.remove(idx)?;
+    let text = entry.1.clone();
+    texts.push_back(entry);
+    Some(text)
+}
+
+// (label, chapter) of every entry of the table of contents
+pub fn toc<R: Read + Seek>(book: &EpubDoc<R>) -> Vec<(String, usize)> {
+    book.toc
+        .iter()
+        .map(|p| (p.label.clone(), book.resource_uri_to_chapter(&p.content)))
+        .filter(|(_, n)| n.is_some())
+        .map(|(l, n)| (l, n.unwrap()))
+        .collect()
+}
+
+fn matcher(query: &str, regex: bool, whole_word: bool, smart_case: bool) -> PyResult<Matcher> {
+    let options = SearchOptions {
+        regex,
+        whole_word,
+        smart_case,
+    };
+    Matcher::new(query, options).map_err(|err| PyValueError::new_err(err.to_string()))
 }
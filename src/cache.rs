@@ -0,0 +1,257 @@
+use crate::book::TermSize;
+use crate::doc::Doc;
+use crate::parser::{render_chapter, Decorator};
+use serde::de::DeserializeOwned;
+use serde::{Deserialize, Serialize};
+use sha2::{Digest, Sha256};
+use std::collections::HashMap;
+use std::fs::{self, File};
+use std::io::{self, BufReader, BufWriter, Write};
+use std::path::{Path, PathBuf};
+use std::process;
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::Arc;
+use std::time::UNIX_EPOCH;
+
+// numbers the temporary files of `write_with`, unique within the process
+static TEMP_FILES: AtomicUsize = AtomicUsize::new(0);
+
+// number of terminal geometries whose layout is kept per book, the least
+// recently used ones are removed, see `LayoutCache::use_geometry`
+const GEOMETRIES: usize = 4;
+
+// version of the stored layout, to be bumped with any change to how chapters
+// are rendered (html2text, its patch, the decorator) or to the `Doc` format.
+// entries of other versions are never read.
+const LAYOUT_VERSION: &str = "v1";
+
+// identifies a version of a file, without reading it
+#[derive(Serialize, Deserialize, PartialEq)]
+pub struct FileStamp {
+    size: u64,
+    mtime: (u64, u32),
+}
+
+impl FileStamp {
+    pub fn of(path: &Path) -> io::Result<FileStamp> {
+        let metadata = fs::metadata(path)?;
+        let mtime = metadata
+            .modified()?
+            .duration_since(UNIX_EPOCH)
+            .unwrap_or_default();
+        Ok(FileStamp {
+            size: metadata.len(),
+            mtime: (mtime.as_secs(), mtime.subsec_nanos()),
+        })
+    }
+}
+
+#[derive(Serialize, Deserialize)]
+struct HashEntry {
+    stamp: FileStamp,
+    hash: String,
+}
+
+pub fn read_json<T: DeserializeOwned>(path: &Path) -> Option<T> {
+    let file = File::open(path).ok()?;
+    serde_json::from_reader(BufReader::new(file)).ok()
+}
+
+// the file is written to a temporary sibling and renamed into place,
+// so a crash (or a second instance) never leaves a half written file behind.
+// threads writing the same file at once each write their own temporary file.
+fn write_with<F>(path: &Path, f: F) -> io::Result<()>
+where
+    F: FnOnce(&mut BufWriter<File>) -> io::Result<()>,
+{
+    if let Some(parent) = path.parent() {
+        fs::create_dir_all(parent)?;
+    }
+    let temp_path = path.with_extension(format!(
+        "tmp{}-{}",
+        process::id(),
+        TEMP_FILES.fetch_add(1, Ordering::Relaxed)
+    ));
+    let mut writer = BufWriter::new(File::create(&temp_path)?);
+    f(&mut writer)?;
+    writer.flush()?;
+    fs::rename(temp_path, path)
+}
+
+pub fn write_atomic(path: &Path, data: &[u8]) -> io::Result<()> {
+    write_with(path, |writer| writer.write_all(data))
+}
+
+pub fn write_json<T: Serialize + ?Sized>(path: &Path, value: &T) -> io::Result<()> {
+    write_with(path, |writer| Ok(serde_json::to_writer(writer, value)?))
+}
+
+// sha256 of the epub file. hashing a big book on every launch is not free,
+// so the digest is remembered together with the file's size and mtime.
+pub fn book_hash(cache_dir: &Path, book_path: &Path) -> io::Result<String> {
+    let index_path = cache_dir.join("layout").join("hashes.json");
+    let key = book_path.to_string_lossy().into_owned();
+    let stamp = FileStamp::of(book_path)?;
+    let mut index: HashMap<String, HashEntry> = read_json(&index_path).unwrap_or_default();
+    if let Some(entry) = index.get(&key) {
+        if entry.stamp == stamp {
+            return Ok(entry.hash.clone());
+        }
+    }
+
+    let mut hasher = Sha256::new();
+    io::copy(&mut File::open(book_path)?, &mut hasher)?;
+    let hash = format!("{:x}", hasher.finalize());
+    index.insert(
+        key,
+        HashEntry {
+            stamp,
+            hash: hash.clone(),
+        },
+    );
+    // failing to remember the hash only costs a rehash next time
+    let _ = write_json(&index_path, &index);
+    Ok(hash)
+}
+
+// persistent layout of a single book, stored under
+// <cache_dir>/layout/<version>/<book hash>/<cols>x<rows>-<x>x<y>/
+// (<cache_dir>/layout/<version>/<book hash>/text/<cols>x<rows>-<x>x<y>/ in text only mode)
+// every terminal geometry gets its own entry, holding the number of lines
+// of every chapter (lines.json) and the rendered chapters (<chapter>.json).
+// only the GEOMETRIES most recently used entries are kept (geometries.json).
+#[derive(Clone)]
+pub struct LayoutCache {
+    dir: PathBuf,
+}
+
+impl LayoutCache {
+    pub fn new(cache_dir: &Path, book_hash: &str, text_only: bool) -> LayoutCache {
+        let dir = cache_dir
+            .join("layout")
+            .join(LAYOUT_VERSION)
+            .join(book_hash);
+        LayoutCache {
+            dir: if text_only { dir.join("text") } else { dir },
+        }
+    }
+
+    fn entry_dir(&self, term_info: TermSize) -> PathBuf {
+        self.dir.join(term_info.dir_name())
+    }
+
+    // marks the entry of `term_info` as the most recently used one, removing
+    // the entries over GEOMETRIES. returns the names of the removed ones, for
+    // what else is kept per geometry (the downscaled images).
+    pub fn use_geometry(&self, term_info: TermSize) -> Vec<String> {
+        let path = self.dir.join("geometries.json");
+        let name = term_info.dir_name();
+        // from the most to the least recently used
+        let mut geometries: Vec<String> = read_json(&path).unwrap_or_default();
+        if geometries.first() == Some(&name) {
+            return Vec::new();
+        }
+        geometries.retain(|geometry| *geometry != name);
+        geometries.insert(0, name);
+        let evicted = geometries.split_off(geometries.len().min(GEOMETRIES));
+        for geometry in &evicted {
+            let _ = fs::remove_dir_all(self.dir.join(geometry));
+        }
+        let _ = write_json(&path, &geometries);
+        evicted
+    }
+
+    pub fn load_number_of_lines(&self, term_info: TermSize) -> Option<Vec<usize>> {
+        read_json(&self.entry_dir(term_info).join("lines.json"))
+    }
+
+    pub fn store_number_of_lines(&self, term_info: TermSize, number_of_lines: &[usize]) {
+        let path = self.entry_dir(term_info).join("lines.json");
+        let _ = write_json(&path, number_of_lines);
+    }
+
+    pub fn load_chapter(
+        &self,
+        term_info: TermSize,
+        chapter: usize,
+        decorator: &Decorator,
+    ) -> Option<Doc> {
+        let path = self.entry_dir(term_info).join(format!("{}.json", chapter));
+        let mut doc: Doc = read_json(&path)?;
+        doc.resolve_images(decorator);
+        Some(doc)
+    }
+
+    pub fn load_or_render(&self, chapter: usize, html: &str, decorator: Decorator) -> Doc {
+        let term_info = decorator.term_info;
+        match self.load_chapter(term_info, chapter, &decorator) {
+            Some(doc) => doc,
+            None => {
+                let doc = render_chapter(html, decorator);
+                self.store_chapter(term_info, chapter, &doc);
+                doc
+            }
+        }
+    }
+
+    pub fn store_chapter(&self, term_info: TermSize, chapter: usize, doc: &Doc) {
+        let path = self.entry_dir(term_info).join(format!("{}.json", chapter));
+        let _ = write_json(&path, doc);
+    }
+}
+
+type ChapterKey = (usize, TermSize);
+
+// rendered chapters kept in memory, evicting the least recently used ones
+// once their (estimated) size goes over the budget.
+pub struct ChapterCache {
+    budget: usize,
+    size: usize,
+    // ordered from the least to the most recently used
+    entries: Vec<(ChapterKey, Arc<Doc>, usize)>,
+}
+
+impl ChapterCache {
+    pub fn new(budget: usize) -> ChapterCache {
+        ChapterCache {
+            budget,
+            size: 0,
+            entries: Vec::new(),
+        }
+    }
+
+    pub fn contains(&self, key: &ChapterKey) -> bool {
+        self.entries.iter().any(|(k, _, _)| k == key)
+    }
+
+    pub fn get(&mut self, key: &ChapterKey) -> Option<Arc<Doc>> {
+        let idx = self.entries.iter().position(|(k, _, _)| k == key)?;
+        let entry = self.entries.remove(idx);
+        let doc = entry.1.clone();
+        self.entries.push(entry);
+        Some(doc)
+    }
+
+    pub fn insert(&mut self, key: ChapterKey, doc: Arc<Doc>) {
+        if let Some(idx) = self.entries.iter().position(|(k, _, _)| *k == key) {
+            let (_, _, size) = self.entries.remove(idx);
+            self.size -= size;
+        }
+        let size = doc.size();
+        self.size += size;
+        self.entries.push((key, doc, size));
+        self.evict();
+    }
+
+    pub fn set_budget(&mut self, budget: usize) {
+        self.budget = budget;
+        self.evict();
+    }
+
+    fn evict(&mut self) {
+        while self.size > self.budget && !self.entries.is_empty() {
+            let (_, _, size) = self.entries.remove(0);
+            self.size -= size;
+        }
+    }
+}
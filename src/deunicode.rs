@@ -1,5 +1,7 @@
 extern crate deunicode;
 use deunicode::deunicode_char;
+use regex::Regex;
+use std::sync::atomic::{AtomicBool, Ordering};
 
 pub struct Range {
     pub start: usize,
@@ -8,51 +10,61 @@ pub struct Range {
 
 pub struct Deunicode {
     deunicoded: String,
-    offsets: Vec<usize>,
+    // ends[i] is the offset in `deunicoded` right after the i'th original char
+    ends: Vec<usize>,
 }
 
 impl From<&str> for Deunicode {
     fn from(s: &str) -> Self {
-        let deunicoded_chars = s.chars().map(|c| deunicode_char(c).unwrap_or(""));
-        Self {
-            deunicoded: deunicoded_chars.clone().collect::<String>(),
-            offsets: deunicoded_chars.map(|c| c.len()).collect(),
+        let mut deunicoded = String::with_capacity(s.len());
+        let mut ends = Vec::with_capacity(s.len());
+        for c in s.chars() {
+            deunicoded.push_str(deunicode_char(c).unwrap_or(""));
+            ends.push(deunicoded.len());
         }
+        Self { deunicoded, ends }
     }
 }
 
 impl Deunicode {
+    pub fn as_str(&self) -> &str {
+        self.deunicoded.as_str()
+    }
+
     // unicoded -> original
+    // the original char is the first one ending after `offset`
     fn convert_offset(&self, offset: usize) -> Option<usize> {
-        let mut count = 0;
-        self.offsets
-            .iter()
-            .enumerate()
-            .find(|(_, &c)| {
-                count += c;
-                offset < count
-            })
-            .map(|(i, _)| i)
+        let idx = self.ends.partition_point(|&end| end <= offset);
+        if idx < self.ends.len() {
+            Some(idx)
+        } else {
+            None
+        }
     }
 
-    pub fn match_indices<F>(&self, f: F, text: String) -> Vec<Range>
-    where
-        F: Fn(&str) -> String,
-    {
-        let filtered_deunicoded = f(self.deunicoded.as_str());
-        let filtered_text = f(text.as_str());
-        filtered_deunicoded
-            .match_indices(&filtered_text)
-            .map(|(idx, s)| {
-                let start = self.convert_offset(idx);
-                let end = self.convert_offset(idx + s.len());
-                (start, end)
-            })
-            .filter(|(s, e)| s.is_some() && e.is_some())
-            .map(|(s, e)| Range {
-                start: s.unwrap(),
-                end: e.unwrap(),
-            })
-            .collect()
+    // char ranges (in the original text) of the non empty matches of `regex`
+    // in the deunicoded text
+    pub fn find_iter(&self, regex: &Regex) -> Vec<Range> {
+        self.find_iter_until(regex, &AtomicBool::new(false))
+            .unwrap_or_default()
+    }
+
+    // `find_iter`, giving up (with None) once `cancelled` is set
+    pub fn find_iter_until(&self, regex: &Regex, cancelled: &AtomicBool) -> Option<Vec<Range>> {
+        let mut ranges = Vec::new();
+        for m in regex.find_iter(&self.deunicoded) {
+            if cancelled.load(Ordering::Relaxed) {
+                return None;
+            }
+            if m.as_str().is_empty() {
+                continue;
+            }
+            if let (Some(start), Some(end)) =
+                (self.convert_offset(m.start()), self.convert_offset(m.end()))
+            {
+                ranges.push(Range { start, end });
+            }
+        }
+        Some(ranges)
     }
 }
@@ -0,0 +1,224 @@
+use crate::image::Image;
+use crate::parser::{Decorator, Element, Style};
+use enumset::EnumSet;
+use serde::{Deserialize, Serialize};
+use std::mem;
+
+// marks a span without a link or an image
+const NONE: u32 = u32::MAX;
+
+#[derive(Clone, Copy, Serialize, Deserialize)]
+pub struct Span {
+    // byte range of the span in `Doc::text`
+    start: u32,
+    len: u32,
+    // column of the span's first char in its line
+    col: u32,
+    // bits of the span's `Style`
+    style: u32,
+    link: u32,
+    image: u32,
+}
+
+// a rendered chapter. the text of all lines is packed into a single buffer
+// and every line is a run of spans over it, so a chapter costs a handful of
+// allocations instead of one (python) object per span.
+#[derive(Serialize, Deserialize)]
+pub struct Doc {
+    text: String,
+    // the spans of line i are spans[lines[i]..lines[i + 1]]
+    lines: Vec<u32>,
+    spans: Vec<Span>,
+    links: Vec<String>,
+    // src of every image, apart from the link of its span (an image is often
+    // wrapped in a link to a bigger copy). the images themselves are not
+    // stored, see `resolve_images`
+    image_srcs: Vec<String>,
+    #[serde(skip)]
+    images: Vec<Option<Image>>,
+}
+
+impl Default for Doc {
+    fn default() -> Self {
+        Self::new()
+    }
+}
+
+impl Doc {
+    pub fn new() -> Doc {
+        Doc {
+            text: String::new(),
+            lines: vec![0],
+            spans: Vec::new(),
+            links: Vec::new(),
+            image_srcs: Vec::new(),
+            images: Vec::new(),
+        }
+    }
+
+    pub fn push_span(
+        &mut self,
+        text: &str,
+        style: Style,
+        link: Option<&str>,
+        image: Option<(&str, Image)>,
+    ) {
+        let line_start = *self.lines.last().unwrap() as usize;
+        let col = match self.spans[line_start..].last() {
+            Some(span) => span.col + self.span_text(span).chars().count() as u32,
+            None => 0,
+        };
+        let link = match link {
+            // spans of the same link usually follow each other
+            Some(link) if self.links.last().map(String::as_str) == Some(link) => {
+                self.links.len() as u32 - 1
+            }
+            Some(link) => {
+                self.links.push(link.to_owned());
+                self.links.len() as u32 - 1
+            }
+            None => NONE,
+        };
+        let image = match image {
+            Some((src, image)) => {
+                self.image_srcs.push(src.to_owned());
+                self.images.push(Some(image));
+                self.images.len() as u32 - 1
+            }
+            None => NONE,
+        };
+        self.spans.push(Span {
+            start: self.text.len() as u32,
+            len: text.len() as u32,
+            col,
+            style: style.effects.as_u32(),
+            link,
+            image,
+        });
+        self.text.push_str(text);
+    }
+
+    pub fn end_line(&mut self) {
+        self.lines.push(self.spans.len() as u32);
+    }
+
+    // images are looked up again through the decorator after loading
+    // a stored chapter, the directory holding them may have moved since.
+    pub fn resolve_images(&mut self, decorator: &Decorator) {
+        self.images = self
+            .image_srcs
+            .iter()
+            .map(|src| decorator.create_image_from_path(src))
+            .collect();
+    }
+
+    pub fn all_images(&self) -> impl Iterator<Item = &Image> {
+        self.images.iter().flatten()
+    }
+
+    pub fn len(&self) -> usize {
+        self.lines.len() - 1
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.len() == 0
+    }
+
+    // estimated memory held by the chapter
+    pub fn size(&self) -> usize {
+        mem::size_of::<Doc>()
+            + self.text.len()
+            + self.lines.len() * mem::size_of::<u32>()
+            + self.spans.len() * mem::size_of::<Span>()
+            + self.links.iter().map(String::len).sum::<usize>()
+            + self.image_srcs.iter().map(String::len).sum::<usize>()
+            + self.images.len() * mem::size_of::<Option<Image>>()
+    }
+
+    fn line_spans(&self, row: usize) -> &[Span] {
+        &self.spans[self.lines[row] as usize..self.lines[row + 1] as usize]
+    }
+
+    fn span_text(&self, span: &Span) -> &str {
+        &self.text[span.start as usize..(span.start + span.len) as usize]
+    }
+
+    fn span_image(&self, span: &Span) -> Option<&Image> {
+        if span.image == NONE {
+            return None;
+        }
+        self.images[span.image as usize].as_ref()
+    }
+
+    // the spans of a line are laid out one after the other in `text`
+    pub fn line_text(&self, row: usize) -> &str {
+        let spans = self.line_spans(row);
+        match (spans.first(), spans.last()) {
+            (Some(first), Some(last)) => {
+                &self.text[first.start as usize..(last.start + last.len) as usize]
+            }
+            _ => "",
+        }
+    }
+
+    // (column, text, style bits) of the spans of a line drawn as text,
+    // images are left out.
+    pub fn text_spans(&self, row: usize) -> Vec<(u32, &str, u32)> {
+        self.line_spans(row)
+            .iter()
+            .filter(|span| self.span_image(span).is_none())
+            .map(|span| (span.col, self.span_text(span), span.style))
+            .collect()
+    }
+
+    // ((column, row), image) of every image starting in the given lines
+    pub fn images(&self, start: usize, end: usize) -> Vec<((u32, usize), Image)> {
+        let mut images = Vec::new();
+        for row in start..end {
+            for span in self.line_spans(row) {
+                if let Some(image) = self.span_image(span) {
+                    if self.span_text(span).starts_with('S') {
+                        images.push(((span.col, row), image.clone()));
+                    }
+                }
+            }
+        }
+        images
+    }
+
+    // number of words in every line (at least one), as counted per span
+    pub fn word_counts(&self, start: usize, end: usize) -> Vec<usize> {
+        (start..end)
+            .map(|row| {
+                let word_count: usize = self
+                    .line_spans(row)
+                    .iter()
+                    .map(|span| self.span_text(span).split_whitespace().count())
+                    .sum();
+                word_count.max(1)
+            })
+            .collect()
+    }
+
+    pub fn elements(&self, row: usize) -> Vec<Element> {
+        self.line_spans(row)
+            .iter()
+            .map(|span| {
+                let link = if span.link == NONE {
+                    None
+                } else {
+                    Some(self.links[span.link as usize].clone())
+                };
+                let style = Style {
+                    effects: EnumSet::from_u32_truncated(span.style),
+                };
+                Element::new(
+                    self.span_text(span).to_owned(),
+                    style,
+                    link,
+                    self.span_image(span).cloned(),
+                )
+            })
+            .collect()
+    }
+}
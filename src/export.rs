@@ -0,0 +1,116 @@
+use crate::archive::Archive;
+use crate::book::TermSize;
+use crate::doc::Doc;
+use crate::image::ImageStore;
+use crate::layout::render;
+use crate::parser::Effect;
+use enumset::EnumSet;
+use pyo3::prelude::*;
+use pyo3::PyIterProtocol;
+use rayon::prelude::*;
+use std::path::{Path, PathBuf};
+use std::sync::mpsc::{sync_channel, Receiver};
+use std::sync::Arc;
+use std::thread;
+
+// a rendered chapter as text, one line per row. with `ansi` the styles of
+// the spans are kept as SGR escape codes.
+fn chapter_text(doc: &Doc, ansi: bool) -> String {
+    let mut text = String::new();
+    for row in 0..doc.len() {
+        if !ansi {
+            text.push_str(doc.line_text(row).trim_end());
+            text.push('\n');
+            continue;
+        }
+        for (_, span, style) in doc.text_spans(row) {
+            let codes: Vec<String> = EnumSet::<Effect>::from_u32_truncated(style)
+                .iter()
+                .filter_map(Effect::sgr)
+                .map(|code| code.to_string())
+                .collect();
+            if codes.is_empty() {
+                text.push_str(span);
+            } else {
+                text.push_str(&format!("\x1b[{}m{}\x1b[0m", codes.join(";"), span));
+            }
+        }
+        text.push('\n');
+    }
+    text
+}
+
+// python iterator over the chapters of a book rendered as text at a given
+// width, without a terminal and without images (they are left as
+// placeholders). the chapters are rendered in parallel a batch at a time,
+// and handed over in order through a bounded channel, so at most a couple
+// of batches are held in memory however long the book is.
+#[pyclass]
+pub struct BookExport {
+    receiver: Option<Receiver<String>>,
+}
+
+#[pymethods]
+impl BookExport {
+    #[new]
+    #[args(ansi = "false")]
+    fn new(path: String, width: u16, ansi: bool) -> PyResult<Self> {
+        let (archive, mut book) = Archive::map(Path::new(&path))?;
+        let batch_size = rayon::current_num_threads().max(1);
+        let (sender, receiver) = sync_channel(batch_size);
+        thread::spawn(move || {
+            let images = ImageStore::disabled(PathBuf::new());
+            // only the width matters, images are never laid out
+            let term_info = TermSize {
+                row: 0,
+                col: width,
+                x: 0,
+                y: 0,
+            };
+            let chapters: Vec<usize> = (0..archive.len()).collect();
+            for batch in chapters.chunks(batch_size) {
+                let htmls: Vec<_> = batch
+                    .iter()
+                    .map(|&chapter| {
+                        archive
+                            .chapter(&mut book, chapter)
+                            .unwrap_or_else(|| Arc::from(""))
+                    })
+                    .collect();
+                let texts: Vec<String> = htmls
+                    .par_iter()
+                    .map(|html| chapter_text(&render(html, &images, term_info), ansi))
+                    .collect();
+                for text in texts {
+                    // the iterator was dropped
+                    if sender.send(text).is_err() {
+                        return;
+                    }
+                }
+            }
+        });
+        Ok(BookExport {
+            receiver: Some(receiver),
+        })
+    }
+}
+
+#[pyproto]
+impl PyIterProtocol for BookExport {
+    fn __iter__(slf: PyRef<Self>) -> PyRef<Self> {
+        slf
+    }
+
+    fn __next__(mut slf: PyRefMut<Self>) -> Option<String> {
+        let receiver = slf.receiver.take()?;
+        let py = slf.py();
+        let (receiver, text) = py.allow_threads(move || {
+            let text = receiver.recv().ok();
+            (receiver, text)
+        });
+        if text.is_some() {
+            slf.receiver = Some(receiver);
+        }
+        text
+    }
+}
@@ -1,5 +1,18 @@
+use crate::book::TermSize;
+use crate::cache::{read_json, write_atomic, write_json};
+use crate::doc::Doc;
+use epub::doc::EpubDoc;
+use image::imageops::FilterType;
+use image::io::Reader;
+use image::ImageOutputFormat;
 use pyo3::prelude::*;
-use std::path::PathBuf;
+use regex::Regex;
+use serde::{Deserialize, Serialize};
+use std::collections::{HashMap, HashSet};
+use std::fs;
+use std::io::{BufRead, Cursor, Read, Seek};
+use std::path::{Path, PathBuf};
+use std::sync::RwLock;
 
 #[pyclass]
 #[derive(Clone, Debug)]
@@ -10,6 +23,10 @@ pub struct Image {
     pub path: PathBuf,
     #[pyo3(get)]
     pub id: String,
+    // copy of the image downscaled to `scaled_size` pixels, the size of the
+    // cells it is drawn in. same as `path` when the image is small enough.
+    pub scaled_path: PathBuf,
+    pub scaled_size: (u32, u32),
 }
 
 impl Image {
@@ -18,6 +35,260 @@ impl Image {
             size: (0, 0),
             path: PathBuf::from(path),
             id: "".into(),
+            scaled_path: PathBuf::from(path),
+            scaled_size: (0, 0),
         }
     }
 }
+
+#[pymethods]
+impl Image {
+    // the file to display, the downscaled copy once it was written
+    #[getter]
+    fn display_path(&self) -> PathBuf {
+        if self.scaled_path.exists() {
+            self.scaled_path.clone()
+        } else {
+            self.path.clone()
+        }
+    }
+}
+
+// what the layout needs to know about an image, read from its header
+#[derive(Clone, Serialize, Deserialize)]
+pub struct ImageMeta {
+    pub dimensions: (u32, u32),
+    // extension of the image's format
+    pub format: Option<String>,
+}
+
+impl ImageMeta {
+    fn read<R: BufRead + Seek>(reader: Reader<R>) -> Option<ImageMeta> {
+        let reader = reader.with_guessed_format().ok()?;
+        let format = reader
+            .format()
+            .and_then(|format| format.extensions_str().first())
+            .map(|extension| extension.to_string());
+        let dimensions = reader.into_dimensions().ok()?;
+        Some(ImageMeta { dimensions, format })
+    }
+}
+
+// images of a single book, extracted on demand into
+// <cache_dir>/images/<book hash>/ where they are kept across sessions.
+pub struct ImageStore {
+    dir: PathBuf,
+    // (path inside the archive, file name)
+    resources: Vec<(PathBuf, String)>,
+    // metadata of the extracted images by file name (`None` for images that
+    // fail to decode), persisted in meta.json. every image header is read once,
+    // laying a chapter out does no image I/O.
+    meta: RwLock<HashMap<String, Option<ImageMeta>>>,
+    // the `src` (and `href`, for svg images) attributes of a chapter
+    references: Regex,
+    // false in text only mode, where images are never extracted nor probed
+    // and the layout puts a placeholder in their place
+    enabled: bool,
+}
+
+impl ImageStore {
+    pub fn new<R: Read + Seek>(dir: PathBuf, book: &EpubDoc<R>) -> ImageStore {
+        let resources = book
+            .resources
+            .values()
+            .filter(|(_, mime)| mime.contains("image"))
+            .filter_map(|(path, _)| {
+                let fname = path.file_name()?.to_str()?.to_owned();
+                Some((path.clone(), fname))
+            })
+            .collect();
+        let mut store = ImageStore::empty(dir);
+        store.resources = resources;
+        store.meta = RwLock::new(read_json(&store.meta_path()).unwrap_or_default());
+        store
+    }
+
+    // a store without any images to extract
+    pub fn empty(dir: PathBuf) -> ImageStore {
+        ImageStore {
+            dir,
+            resources: Vec::new(),
+            meta: RwLock::new(HashMap::new()),
+            references: Regex::new(r#"(?i)\b(?:src|href)\s*=\s*(?:"([^"]*)"|'([^']*)')"#).unwrap(),
+            enabled: true,
+        }
+    }
+
+    // a store for text only mode
+    pub fn disabled(dir: PathBuf) -> ImageStore {
+        ImageStore {
+            enabled: false,
+            ..ImageStore::empty(dir)
+        }
+    }
+
+    pub fn dir(&self) -> &Path {
+        &self.dir
+    }
+
+    pub fn enabled(&self) -> bool {
+        self.enabled
+    }
+
+    fn meta_path(&self) -> PathBuf {
+        self.dir.join("meta.json")
+    }
+
+    fn persist_meta(&self, meta: &HashMap<String, Option<ImageMeta>>) {
+        // a lost entry is only read again from the image next session
+        let _ = write_json(&self.meta_path(), meta);
+    }
+
+    // metadata of an extracted image, `None` when it is missing or broken.
+    pub fn meta(&self, fname: &str) -> Option<ImageMeta> {
+        if !self.enabled {
+            return None;
+        }
+        if let Some(meta) = self.meta.read().unwrap().get(fname) {
+            return meta.clone();
+        }
+        // extracted before its metadata was recorded
+        let full_path = self.dir.join(fname);
+        if !full_path.exists() {
+            return None;
+        }
+        let meta = Reader::open(full_path).ok().and_then(ImageMeta::read);
+        let mut cache = self.meta.write().unwrap();
+        cache.insert(fname.to_owned(), meta.clone());
+        self.persist_meta(&cache);
+        meta
+    }
+
+    // where the copy of `fname` downscaled for `term_info` is kept
+    pub fn scaled_path(&self, fname: &str, term_info: TermSize) -> PathBuf {
+        self.dir
+            .join(term_info.dir_name())
+            .join(format!("{}.png", fname))
+    }
+
+    // removes the copies downscaled for a geometry (named by `dir_name`)
+    pub fn evict_scaled(&self, dir_name: &str) {
+        if self.enabled {
+            let _ = fs::remove_dir_all(self.dir.join(dir_name));
+        }
+    }
+
+    // writes the downscaled copy of `image`, decoding and scaling big images
+    // once here instead of every time they are displayed.
+    pub fn scale(&self, image: &Image) {
+        if image.scaled_path == image.path || image.scaled_path.exists() {
+            return;
+        }
+        let (width, height) = image.scaled_size;
+        if let Ok(original) = image::open(&image.path) {
+            let scaled = original.resize(width, height, FilterType::Triangle);
+            let mut data = Vec::new();
+            if scaled.write_to(&mut data, ImageOutputFormat::Png).is_ok() {
+                let _ = write_atomic(&image.scaled_path, &data);
+            }
+        }
+    }
+
+    pub fn scale_all(&self, doc: &Doc) {
+        for image in doc.all_images() {
+            self.scale(image);
+        }
+    }
+
+    // file names of the images referenced by `html`
+    fn referenced(&self, html: &str) -> HashSet<String> {
+        self.references
+            .captures_iter(html)
+            .filter_map(|captures| captures.get(1).or_else(|| captures.get(2)))
+            .filter_map(|src| src_file_name(src.as_str()))
+            .collect()
+    }
+
+    // writes every image referenced by `html` that was not extracted yet,
+    // recording its metadata on the way.
+    pub fn extract<R: Read + Seek>(&self, html: &str, book: &mut EpubDoc<R>) {
+        let referenced = self.referenced(html);
+        let mut extracted = Vec::new();
+        for (path, fname) in self.resources.iter() {
+            let full_path = self.dir.join(fname);
+            if !referenced.contains(fname) || full_path.exists() {
+                continue;
+            }
+            if let Ok(image_data) = book.get_resource_by_path(path) {
+                let meta = ImageMeta::read(Reader::new(Cursor::new(&image_data)));
+                if write_atomic(&full_path, &image_data).is_ok() {
+                    extracted.push((fname.clone(), meta));
+                }
+            }
+        }
+        self.record_meta(extracted);
+    }
+
+    // records the metadata of every image referenced by `html` that is not
+    // known yet, read from the archive without writing the image out.
+    // enough to lay the chapter out, the file is extracted once it is shown.
+    pub fn probe<R: Read + Seek>(&self, html: &str, book: &mut EpubDoc<R>) {
+        let referenced = self.referenced(html);
+        let mut probed = Vec::new();
+        for (path, fname) in self.resources.iter() {
+            if !referenced.contains(fname) || self.meta.read().unwrap().contains_key(fname) {
+                continue;
+            }
+            if let Ok(image_data) = book.get_resource_by_path(path) {
+                let meta = ImageMeta::read(Reader::new(Cursor::new(&image_data)));
+                probed.push((fname.clone(), meta));
+            }
+        }
+        self.record_meta(probed);
+    }
+
+    fn record_meta(&self, entries: Vec<(String, Option<ImageMeta>)>) {
+        if !entries.is_empty() {
+            let mut cache = self.meta.write().unwrap();
+            cache.extend(entries);
+            self.persist_meta(&cache);
+        }
+    }
+}
+
+// the file name an image reference (`src` or `href`) points to, without
+// its query or fragment and percent-decoded, as in the archive's paths
+pub fn src_file_name(src: &str) -> Option<String> {
+    let path = src.split(|c| c == '?' || c == '#').next()?;
+    let name = percent_decode(path.rsplit('/').next()?);
+    if name.is_empty() {
+        None
+    } else {
+        Some(name)
+    }
+}
+
+fn percent_decode(text: &str) -> String {
+    let bytes = text.as_bytes();
+    let mut decoded = Vec::with_capacity(bytes.len());
+    let mut i = 0;
+    while i < bytes.len() {
+        let escaped = match bytes.get(i + 1..i + 3) {
+            Some(hex) if bytes[i] == b'%' => std::str::from_utf8(hex)
+                .ok()
+                .and_then(|hex| u8::from_str_radix(hex, 16).ok()),
+            _ => None,
+        };
+        match escaped {
+            Some(byte) => {
+                decoded.push(byte);
+                i += 3;
+            }
+            None => {
+                decoded.push(bytes[i]);
+                i += 1;
+            }
+        }
+    }
+    String::from_utf8_lossy(&decoded).into_owned()
+}
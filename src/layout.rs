@@ -0,0 +1,52 @@
+use crate::book::TermSize;
+use crate::doc::Doc;
+use crate::image::ImageStore;
+use crate::parser::{count_lines, render_chapter, Decorator};
+use rayon::prelude::*;
+use std::sync::atomic::{AtomicBool, AtomicUsize, Ordering};
+
+// progress of laying out a book, shared with whoever waits for it
+#[derive(Default)]
+pub struct Progress {
+    // chapters laid out so far
+    pub done: AtomicUsize,
+    pub cancelled: AtomicBool,
+}
+
+// lays out every chapter (given as its html) at the width of `term_info`
+// and returns their number of lines, in order. html2text renders a chapter
+// in a single pass, so the chapters are spread over rayon's thread pool.
+pub fn number_of_lines<S: AsRef<str> + Sync>(
+    chapters: &[S],
+    images: &ImageStore,
+    term_info: TermSize,
+) -> Vec<usize> {
+    number_of_lines_with(chapters, images, term_info, &Progress::default()).unwrap()
+}
+
+// like `number_of_lines`, reporting to `progress`. returns `None` once
+// cancelled, the chapters being laid out are finished but no new one starts.
+pub fn number_of_lines_with<S: AsRef<str> + Sync>(
+    chapters: &[S],
+    images: &ImageStore,
+    term_info: TermSize,
+    progress: &Progress,
+) -> Option<Vec<usize>> {
+    let decorator = Decorator::new(images, term_info);
+    chapters
+        .par_iter()
+        .map(|html| {
+            if progress.cancelled.load(Ordering::Relaxed) {
+                return None;
+            }
+            let lines = count_lines(html.as_ref(), decorator);
+            progress.done.fetch_add(1, Ordering::Relaxed);
+            Some(lines)
+        })
+        .collect()
+}
+
+// renders a single chapter, as when the reader opens it
+pub fn render(html: &str, images: &ImageStore, term_info: TermSize) -> Doc {
+    render_chapter(html, Decorator::new(images, term_info))
+}
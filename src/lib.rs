@@ -1,14 +1,43 @@
 use pyo3::prelude::*;
+mod archive;
 mod book;
-mod deunicode;
+mod cache;
+pub mod deunicode;
+mod doc;
+mod export;
 mod image;
+pub mod layout;
+mod library;
 mod parser;
+mod relayout;
+pub mod search;
+mod search_job;
+mod timings;
+mod view;
+mod worker;
 use crate::book::Book;
+pub use crate::book::TermSize;
+pub use crate::doc::Doc;
+use crate::export::BookExport;
 use crate::image::Image;
+pub use crate::image::ImageStore;
+use crate::library::{Catalog, CatalogEntry};
+use crate::parser::Effect;
+use crate::relayout::LinesJob;
+use crate::search_job::{ChapterSearchJob, SearchJob};
+use crate::view::ChapterView;
 
 #[pymodule]
 fn nuber(_py: Python, m: &PyModule) -> PyResult<()> {
     m.add_class::<Book>()?;
     m.add_class::<Image>()?;
+    m.add_class::<ChapterView>()?;
+    m.add_class::<LinesJob>()?;
+    m.add_class::<SearchJob>()?;
+    m.add_class::<ChapterSearchJob>()?;
+    m.add_class::<Catalog>()?;
+    m.add_class::<CatalogEntry>()?;
+    m.add_class::<BookExport>()?;
+    m.add("STYLES", Effect::bits())?;
     Ok(())
 }
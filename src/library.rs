@@ -0,0 +1,137 @@
+use crate::book::toc;
+use crate::cache::{read_json, write_json, FileStamp};
+use epub::doc::EpubDoc;
+use pyo3::prelude::*;
+use rayon::prelude::*;
+use serde::{Deserialize, Serialize};
+use std::collections::HashMap;
+use std::fs;
+use std::path::{Path, PathBuf};
+
+// what the library shows of a book, read from its metadata alone
+#[pyclass]
+#[derive(Clone, Serialize, Deserialize)]
+pub struct CatalogEntry {
+    #[pyo3(get)]
+    pub path: String,
+    #[pyo3(get)]
+    pub title: String,
+    #[pyo3(get)]
+    pub author: String,
+    // number of spine items
+    #[pyo3(get)]
+    pub chapters: usize,
+    #[pyo3(get)]
+    pub toc: Vec<(String, usize)>,
+}
+
+impl CatalogEntry {
+    fn read(path: &Path) -> Option<CatalogEntry> {
+        let book = EpubDoc::new(path).ok()?;
+        let file_stem = path.file_stem()?.to_string_lossy().into_owned();
+        Some(CatalogEntry {
+            path: path.to_string_lossy().into_owned(),
+            title: book.mdata("title").unwrap_or(file_stem),
+            author: book.mdata("creator").unwrap_or_default(),
+            chapters: book.get_num_pages(),
+            toc: toc(&book),
+        })
+    }
+}
+
+#[derive(Serialize, Deserialize)]
+struct Record {
+    stamp: FileStamp,
+    // `None` for files that are not readable epubs, so they are not
+    // opened again until they change
+    entry: Option<CatalogEntry>,
+}
+
+// every epub under a directory tree, sorted
+fn find_epubs(dir: &Path, found: &mut Vec<PathBuf>) {
+    let entries = match fs::read_dir(dir) {
+        Ok(entries) => entries,
+        Err(_) => return,
+    };
+    for entry in entries.flatten() {
+        let path = entry.path();
+        match entry.file_type() {
+            Ok(file_type) if file_type.is_dir() => find_epubs(&path, found),
+            Ok(_) => {
+                let is_epub = path
+                    .extension()
+                    .map_or(false, |extension| extension.eq_ignore_ascii_case("epub"));
+                if is_epub {
+                    found.push(path);
+                }
+            }
+            Err(_) => {}
+        }
+    }
+}
+
+// the books of the library, persisted in <cache_dir>/library.json by path
+// together with the stamp (size and mtime) of the file they were read from.
+// a scan only opens the books that are new or changed since, in parallel.
+#[pyclass]
+pub struct Catalog {
+    path: PathBuf,
+    records: HashMap<String, Record>,
+}
+
+#[pymethods]
+impl Catalog {
+    #[new]
+    fn new(cache_dir: String) -> Self {
+        let path = Path::new(&cache_dir).join("library.json");
+        let records = read_json(&path).unwrap_or_default();
+        Catalog { path, records }
+    }
+
+    // the books under `dir`, sorted by path
+    fn scan(&mut self, py: Python, dir: String) -> Vec<CatalogEntry> {
+        let records = &self.records;
+        let (scanned, changed) = py.allow_threads(|| {
+            let mut paths = Vec::new();
+            find_epubs(Path::new(&dir), &mut paths);
+            paths.sort();
+            let scanned: Vec<(String, Record, bool)> = paths
+                .par_iter()
+                .filter_map(|path| {
+                    let stamp = FileStamp::of(path).ok()?;
+                    let key = path.to_string_lossy().into_owned();
+                    match records.get(&key) {
+                        Some(record) if record.stamp == stamp => {
+                            let entry = record.entry.clone();
+                            Some((key, Record { stamp, entry }, false))
+                        }
+                        _ => {
+                            let entry = CatalogEntry::read(path);
+                            Some((key, Record { stamp, entry }, true))
+                        }
+                    }
+                })
+                .collect();
+            let changed = scanned.iter().any(|(_, _, changed)| *changed);
+            (scanned, changed)
+        });
+
+        let entries = scanned
+            .iter()
+            .filter_map(|(_, record, _)| record.entry.clone())
+            .collect();
+        // books gone from `dir` are dropped, books outside of it are kept
+        let prefix = Path::new(&dir);
+        let known = self.records.len();
+        self.records
+            .retain(|key, _| !Path::new(key).starts_with(prefix));
+        let gone = known - self.records.len() > scanned.len();
+        self.records
+            .extend(scanned.into_iter().map(|(key, record, _)| (key, record)));
+        if changed || gone {
+            // a lost catalog only costs a rescan next time
+            let _ = write_json(&self.path, &self.records);
+        }
+        entries
+    }
+}
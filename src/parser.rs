@@ -1,12 +1,16 @@
 #![allow(non_snake_case)]
 
 use crate::book::TermSize;
-use crate::image::Image;
+use crate::doc::Doc;
+use crate::image::{src_file_name, Image, ImageStore};
 use enumset::{enum_set, EnumSet, EnumSetType};
-use html2text::render::text_renderer::{RichAnnotation, TaggedLine, TextDecorator};
+use html2text::parse;
+use html2text::render::text_renderer::{
+    RichAnnotation, TaggedLine, TaggedLineElement, TextDecorator,
+};
 use pyo3::prelude::*;
+use std::collections::HashMap;
 use std::iter::FromIterator;
-use std::path::Path;
 
 #[derive(EnumSetType, Debug)]
 pub enum Effect {
@@ -18,6 +22,39 @@ pub enum Effect {
     Image,
 }
 
+impl Effect {
+    pub fn name(self) -> &'static str {
+        match self {
+            Effect::Bold => "bold",
+            Effect::Italic => "italic",
+            Effect::Reverse => "reverse",
+            Effect::Underline => "underline",
+            Effect::Strikethrough => "strikethrough",
+            Effect::Image => "image",
+        }
+    }
+
+    // SGR parameter of the effect in ANSI escape codes
+    pub fn sgr(self) -> Option<u8> {
+        match self {
+            Effect::Bold => Some(1),
+            Effect::Italic => Some(3),
+            Effect::Underline => Some(4),
+            Effect::Reverse => Some(7),
+            Effect::Strikethrough => Some(9),
+            Effect::Image => None,
+        }
+    }
+
+    // name -> bit of every effect in the bits of a `Style`
+    pub fn bits() -> HashMap<&'static str, u32> {
+        EnumSet::<Effect>::all()
+            .iter()
+            .map(|effect| (effect.name(), EnumSet::only(effect).as_u32()))
+            .collect()
+    }
+}
+
 #[derive(Clone, Copy, Debug, PartialEq, Eq, Hash)]
 pub struct Style {
     pub effects: EnumSet<Effect>,
@@ -69,18 +106,7 @@ impl<T: Into<Style>> FromIterator<T> for Style {
 
 impl IntoPy<PyObject> for Style {
     fn into_py(self, py: Python) -> PyObject {
-        let effects: Vec<&str> = self
-            .effects
-            .iter()
-            .map(|e| match e {
-                Effect::Bold => "bold",
-                Effect::Italic => "italic",
-                Effect::Reverse => "reverse",
-                Effect::Underline => "underline",
-                Effect::Strikethrough => "strikethrough",
-                Effect::Image => "image",
-            })
-            .collect();
+        let effects: Vec<&str> = self.effects.iter().map(Effect::name).collect();
         effects.into_py(py)
     }
 }
@@ -89,13 +115,13 @@ impl IntoPy<PyObject> for Style {
 #[derive(Clone, Debug, Default)]
 pub struct Element {
     #[pyo3(get)]
-    text: String,
+    pub text: String,
     #[pyo3(get)]
-    style: Style,
+    pub style: Style,
     #[pyo3(get)]
-    target: Option<String>,
+    pub target: Option<String>,
     #[pyo3(get)]
-    image_info: Option<Image>,
+    pub image_info: Option<Image>,
 }
 
 impl Element {
@@ -153,30 +179,23 @@ impl Converter<RichAnnotation> for RichConverter {
 
 #[derive(Copy, Clone)]
 pub struct Decorator<'a> {
-    pub root_dir: &'a Path,
+    pub images: &'a ImageStore,
     pub term_info: TermSize,
 }
 
 impl<'a> Decorator<'a> {
-    pub fn new(root_dir: &'a Path, term_info: TermSize) -> Decorator {
-        Decorator {
-            root_dir,
-            term_info,
-        }
+    pub fn new(images: &'a ImageStore, term_info: TermSize) -> Decorator {
+        Decorator { images, term_info }
     }
 
-    fn create_image_from_path(&self, url: &str) -> Option<Image> {
-        let path = Path::new(url);
-        let data = path.file_name().and_then(|fname| {
-            let full_path = Path::new(self.root_dir).join(fname);
-            if let Ok(dimensions) = image::image_dimensions(&full_path) {
-                Some((dimensions, full_path))
-            } else {
-                None
-            }
+    pub fn create_image_from_path(&self, url: &str) -> Option<Image> {
+        let fname = src_file_name(url);
+        let data = fname.as_deref().and_then(|fname| {
+            let meta = self.images.meta(fname)?;
+            Some((meta.dimensions, fname))
         });
 
-        if let Some((dimensions, full_path)) = data {
+        if let Some((dimensions, fname)) = data {
             let (img_width_px, img_height_px) = dimensions;
             let rows = self.term_info.row as u32;
             let cols = self.term_info.col as u32;
@@ -189,10 +208,24 @@ impl<'a> Decorator<'a> {
             let img_width_cols_fit = std::cmp::min(img_width_cols, cols);
             let img_height_rows_fit = ceil(img_width_cols_fit * img_height_rows, img_width_cols);
 
+            // the pixels of the cells the image is drawn in
+            let scaled_size = (
+                img_width_cols_fit * x / cols.max(1),
+                img_height_rows_fit * y / rows.max(1),
+            );
+            let full_path = self.images.dir().join(fname);
+            let scaled_path = if img_width_px <= scaled_size.0 && img_height_px <= scaled_size.1 {
+                full_path.clone()
+            } else {
+                self.images.scaled_path(fname, self.term_info)
+            };
+
             Some(Image {
                 size: (img_width_cols_fit, img_height_rows_fit),
                 path: full_path,
                 id: "".into(),
+                scaled_path,
+                scaled_size,
             })
         } else {
             None
@@ -205,9 +238,10 @@ impl<'a> Decorator<'a> {
             .unwrap_or((0, 0))
     }
 
-    pub fn get_image_info(&self, annotation: &'a RichAnnotation) -> Option<Image> {
+    // (src, image) of an image annotation
+    pub fn get_image_info<'b>(&self, annotation: &'b RichAnnotation) -> Option<(&'b str, Image)> {
         if let RichAnnotation::Image(url) = annotation {
-            self.create_image_from_path(url)
+            Some((url, self.create_image_from_path(url)?))
         } else {
             None
         }
@@ -285,7 +319,16 @@ impl<'a> TextDecorator for Decorator<'a> {
         RichAnnotation::Preformat(true)
     }
 
-    fn decorate_image(&mut self, _title: &str, src: &str) -> (String, Self::Annotation) {
+    fn decorate_image(&mut self, title: &str, src: &str) -> (String, Self::Annotation) {
+        if !self.images.enabled() {
+            // a single line naming the image, the layout never looks at it
+            let placeholder = if title.trim().is_empty() {
+                "[image]".to_string()
+            } else {
+                format!("[image: {}]", title.trim())
+            };
+            return (placeholder, RichAnnotation::Image(src.to_string()));
+        }
         let (width, height) = self.get_image_dimensions(src);
         let mut first_row = "S".to_string();
         first_row.push_str(&"I".repeat(width.saturating_sub(1) as usize));
@@ -307,6 +350,40 @@ impl<'a> TextDecorator for Decorator<'a> {
     }
 
     fn make_subblock_decorator(&self) -> Self {
-        Decorator::new(self.root_dir, self.term_info)
+        Decorator::new(self.images, self.term_info)
+    }
+}
+
+pub fn count_lines(html: &str, decorator: Decorator) -> usize {
+    let render_tree = parse(html.as_bytes());
+    render_tree
+        .render(decorator.term_info.col as usize, decorator)
+        .into_lines()
+        .len()
+}
+
+pub fn render_chapter(html: &str, decorator: Decorator) -> Doc {
+    let mut doc = Doc::new();
+    let rich_converter = RichConverter;
+    let render_tree = parse(html.as_bytes());
+    let lines = render_tree
+        .render(decorator.term_info.col as usize, decorator)
+        .into_lines();
+
+    for line in lines {
+        for element in line.iter() {
+            if let TaggedLineElement::Str(ts) = element {
+                let styles: Vec<_> = ts
+                    .tag
+                    .iter()
+                    .filter_map(|a| rich_converter.get_style(a))
+                    .collect();
+                let link_target = ts.tag.iter().find_map(|a| rich_converter.get_link(a));
+                let image_info = ts.tag.iter().find_map(|a| decorator.get_image_info(a));
+                doc.push_span(&ts.s, Style::merge(&styles), link_target, image_info);
+            }
+        }
+        doc.end_line();
     }
+    doc
 }
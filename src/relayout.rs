@@ -0,0 +1,94 @@
+use crate::archive::Archive;
+use crate::book::TermSize;
+use crate::cache::LayoutCache;
+use crate::image::ImageStore;
+use crate::layout::{number_of_lines_with, Progress};
+use pyo3::prelude::*;
+use std::sync::atomic::Ordering;
+use std::sync::{Arc, Mutex};
+use std::thread;
+
+// number of lines of every chapter (but the first, like
+// `Book.number_of_lines`), counted on a background thread with its own
+// handle to the (mapped) epub. a newer job cancels the one it replaces.
+#[pyclass]
+pub struct LinesJob {
+    progress: Arc<Progress>,
+    total: usize,
+    result: Arc<Mutex<Option<Vec<usize>>>>,
+}
+
+impl LinesJob {
+    pub fn spawn(
+        archive: Arc<Archive>,
+        total: usize,
+        images: Arc<ImageStore>,
+        layout_cache: LayoutCache,
+        term_info: TermSize,
+    ) -> LinesJob {
+        let progress = Arc::new(Progress::default());
+        let result = Arc::new(Mutex::new(layout_cache.load_number_of_lines(term_info)));
+        if result.lock().unwrap().is_none() {
+            let progress = progress.clone();
+            let result = result.clone();
+            thread::spawn(move || {
+                let mut book = match archive.open() {
+                    Some(book) => book,
+                    None => return,
+                };
+                let mut chapters = Vec::new();
+                for chapter in 1..archive.len() {
+                    if progress.cancelled.load(Ordering::Relaxed) {
+                        return;
+                    }
+                    let html = archive
+                        .chapter(&mut book, chapter)
+                        .unwrap_or_else(|| Arc::from(""));
+                    images.probe(&html, &mut book);
+                    chapters.push(html);
+                }
+                if let Some(number_of_lines) =
+                    number_of_lines_with(&chapters, &images, term_info, &progress)
+                {
+                    layout_cache.store_number_of_lines(term_info, &number_of_lines);
+                    *result.lock().unwrap() = Some(number_of_lines);
+                }
+            });
+        }
+        LinesJob {
+            progress,
+            total,
+            result,
+        }
+    }
+
+    // a handle on the same job
+    pub fn share(&self) -> LinesJob {
+        LinesJob {
+            progress: self.progress.clone(),
+            total: self.total,
+            result: self.result.clone(),
+        }
+    }
+}
+
+#[pymethods]
+impl LinesJob {
+    // (chapters laid out, chapters to lay out)
+    #[getter]
+    fn progress(&self) -> (usize, usize) {
+        match *self.result.lock().unwrap() {
+            Some(_) => (self.total, self.total),
+            None => (self.progress.done.load(Ordering::Relaxed), self.total),
+        }
+    }
+
+    // the number of lines once counted
+    fn result(&self) -> Option<Vec<usize>> {
+        self.result.lock().unwrap().clone()
+    }
+
+    pub fn cancel(&self) {
+        self.progress.cancelled.store(true, Ordering::Relaxed);
+    }
+}
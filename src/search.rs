@@ -0,0 +1,259 @@
+use crate::archive::Archive;
+use crate::cache::{read_json, write_json};
+use crate::deunicode::{Deunicode, Range};
+use crate::doc::Doc;
+use html2text::from_read;
+use rayon::prelude::*;
+use rayon::ThreadPoolBuilder;
+use regex::{Regex, RegexBuilder};
+use serde::{Deserialize, Serialize};
+use std::collections::{BTreeSet, HashMap, HashSet};
+use std::path::PathBuf;
+use std::sync::atomic::{AtomicBool, Ordering};
+use std::sync::{Arc, Mutex};
+use std::thread;
+
+pub type Head = (usize, usize);
+pub type LinesLengths = Vec<usize>;
+pub type Highlight = (Head, LinesLengths);
+
+// tokens do not depend on the layout, so the chapters are rendered once
+// at a width wide enough to never break a word.
+const INDEX_WIDTH: usize = 1000;
+
+// niceness of the threads building the index, below the reader's own work
+const INDEX_NICENESS: i32 = 10;
+
+fn normalize(text: &str) -> String {
+    Deunicode::from(text).as_str().to_ascii_lowercase()
+}
+
+fn tokens(text: &str) -> impl Iterator<Item = &str> {
+    text.split(|c: char| !c.is_ascii_alphanumeric())
+        .filter(|token| !token.is_empty())
+}
+
+// inverted index over the deunicoded text of the whole book,
+// mapping every token to the (sorted) chapters containing it.
+#[derive(Serialize, Deserialize, Default)]
+pub struct SearchIndex {
+    postings: HashMap<String, Vec<usize>>,
+}
+
+impl SearchIndex {
+    fn build(archive: &Archive) -> Option<SearchIndex> {
+        let mut book = archive.open()?;
+        let chapters: Vec<_> = (0..archive.len())
+            .filter_map(|chapter| Some((chapter, archive.chapter(&mut book, chapter)?)))
+            .collect();
+        // rendering and normalizing dominate, and are independent per chapter.
+        // the index is built while the reader starts up (and counts the lines
+        // of the book on rayon's global pool), so it gets a pool of its own,
+        // half the size and at a lower priority.
+        let pool = ThreadPoolBuilder::new()
+            .num_threads((rayon::current_num_threads() / 2).max(1))
+            .start_handler(|_| unsafe {
+                libc::nice(INDEX_NICENESS);
+            })
+            .build()
+            .ok()?;
+        let chapter_tokens: Vec<(usize, HashSet<String>)> = pool.install(|| {
+            chapters
+                .par_iter()
+                .map(|(chapter, html)| {
+                    let text = normalize(&from_read(html.as_bytes(), INDEX_WIDTH));
+                    (*chapter, tokens(&text).map(str::to_owned).collect())
+                })
+                .collect()
+        });
+
+        let mut postings: HashMap<String, Vec<usize>> = HashMap::new();
+        // chapters are visited in order, keeping every posting list sorted
+        for (chapter, tokens) in chapter_tokens {
+            for token in tokens {
+                postings.entry(token).or_default().push(chapter);
+            }
+        }
+        Some(SearchIndex { postings })
+    }
+
+    // loads the index persisted at `index_path`, or builds (and persists) it
+    // in the background. `slot` is filled once the index is ready.
+    pub fn load_or_spawn(
+        archive: Arc<Archive>,
+        index_path: PathBuf,
+    ) -> Arc<Mutex<Option<SearchIndex>>> {
+        let slot = Arc::new(Mutex::new(read_json(&index_path)));
+        if slot.lock().unwrap().is_none() {
+            let slot = slot.clone();
+            thread::spawn(move || {
+                if let Some(index) = SearchIndex::build(&archive) {
+                    let _ = write_json(&index_path, &index);
+                    *slot.lock().unwrap() = Some(index);
+                }
+            });
+        }
+        slot
+    }
+
+    // chapters which may contain `query`. for the query to appear in a chapter
+    // each of its tokens has to be part of some token of the chapter.
+    // returns `None` when the query has no tokens to narrow the search with.
+    pub fn chapters(&self, query: &str) -> Option<Vec<usize>> {
+        let query = normalize(query);
+        let mut candidates: Option<BTreeSet<usize>> = None;
+        for query_token in tokens(&query) {
+            let chapters: BTreeSet<usize> = self
+                .postings
+                .iter()
+                .filter(|(token, _)| token.contains(query_token))
+                .flat_map(|(_, chapters)| chapters.iter().copied())
+                .collect();
+            candidates = Some(match candidates {
+                Some(candidates) => candidates.intersection(&chapters).copied().collect(),
+                None => chapters,
+            });
+        }
+        candidates.map(|candidates| candidates.into_iter().collect())
+    }
+}
+
+#[derive(Clone, Copy, Default)]
+pub struct SearchOptions {
+    // the query is a regular expression, not a literal string
+    pub regex: bool,
+    // matches have to start and end on word boundaries
+    pub whole_word: bool,
+    // the search is case sensitive when the query has upper case letters
+    pub smart_case: bool,
+}
+
+// a query compiled against the deunicoded text of chapters
+pub struct Matcher {
+    regex: Regex,
+}
+
+impl Matcher {
+    pub fn new(query: &str, options: SearchOptions) -> Result<Matcher, regex::Error> {
+        let query = Deunicode::from(query);
+        let query = query.as_str();
+        let mut pattern = if options.regex {
+            query.to_owned()
+        } else {
+            regex::escape(query)
+        };
+        if options.whole_word {
+            pattern = format!(r"\b(?:{})\b", pattern);
+        }
+        let case_sensitive = options.smart_case && query.chars().any(|c| c.is_ascii_uppercase());
+        let regex = RegexBuilder::new(&pattern)
+            .case_insensitive(!case_sensitive)
+            .build()?;
+        Ok(Matcher { regex })
+    }
+}
+
+// the searchable text of a rendered chapter: its deunicoded text,
+// the map back to the original chars, and the length of its lines.
+// it only depends on the layout, so searching it again costs only the scan.
+pub struct ChapterText {
+    text: Deunicode,
+    lines_len: LinesLengths,
+}
+
+impl ChapterText {
+    pub fn new(text: &str, lines_len: LinesLengths) -> ChapterText {
+        ChapterText {
+            text: Deunicode::from(text),
+            lines_len,
+        }
+    }
+
+    pub fn from_doc(doc: &Doc) -> ChapterText {
+        let (text, lines_len) = doc_text(doc);
+        ChapterText::new(&text, lines_len)
+    }
+
+    pub fn highlights(&self, matcher: &Matcher) -> Vec<Highlight> {
+        map_to_lines(&self.text.find_iter(&matcher.regex), &self.lines_len)
+    }
+
+    // `highlights`, giving up (with None) once `cancelled` is set
+    pub fn highlights_until(
+        &self,
+        matcher: &Matcher,
+        cancelled: &AtomicBool,
+    ) -> Option<Vec<Highlight>> {
+        let ranges = self.text.find_iter_until(&matcher.regex, cancelled)?;
+        if cancelled.load(Ordering::Relaxed) {
+            return None;
+        }
+        Some(map_to_lines(&ranges, &self.lines_len))
+    }
+}
+
+// the text of a rendered chapter as a single string, every line trimmed and
+// followed by a space, and the length (in chars) of every line
+pub fn doc_text(doc: &Doc) -> (String, LinesLengths) {
+    let mut lines_len = Vec::new();
+    let mut text = String::new();
+    for row in 0..doc.len() {
+        let line = doc.line_text(row).trim_end();
+        text.push_str(line);
+        text.push(' ');
+        lines_len.push(line.chars().count() + 1);
+    }
+    (text, lines_len)
+}
+
+// maps char ranges of a chapter's text to the (row, col) of their first char
+// and the number of chars to highlight in every line they span.
+// the line of a range is found by a binary search over the line ends,
+// so the cost per range does not grow with its position in the chapter.
+pub fn map_to_lines(ranges: &[Range], lines_len: &[usize]) -> Vec<Highlight> {
+    // line_ends[i] is the offset right after the i'th line
+    let line_ends: Vec<usize> = lines_len
+        .iter()
+        .scan(0, |end, line_len| {
+            *end += line_len;
+            Some(*end)
+        })
+        .collect();
+    let mut matches = Vec::with_capacity(ranges.len());
+    for range in ranges {
+        let row_idx = line_ends.partition_point(|&end| end <= range.start);
+        if row_idx == line_ends.len() {
+            continue;
+        }
+        let col_idx = range.start - (line_ends[row_idx] - lines_len[row_idx]);
+        let first_char = (row_idx, col_idx);
+        let mut query_len = range.end - range.start;
+        // create a vec of following lines after the first match
+        // each index is the next line with the
+        // specified number of characters to highlight.
+        // the highlight in the first line starts from `col_idx`
+        // in the rest (if exist) of the lines - start from 0.
+        let mut lines_len_iter = lines_len[row_idx..].iter();
+        let first_line_len = lines_len_iter.next().unwrap();
+        // because the first line is special, we will treat it
+        // first and then iterate over the rest.
+        let first_highlight = query_len.min(first_line_len - col_idx);
+        let mut highlights = Vec::from([first_highlight]);
+        // subtract the amount of chars we pushed into `highlights`
+        query_len = query_len.saturating_sub(first_highlight);
+        // iterate over the rest of the lines
+        for &line_len in lines_len_iter {
+            // if the rest of the highlight can fit into the line
+            // we do so and stop iterating. we're done.
+            if line_len >= query_len {
+                highlights.push(query_len);
+                break;
+            }
+            // otherwise, we just enter the line_len and subtract
+            highlights.push(line_len);
+            query_len = query_len.saturating_sub(line_len);
+        }
+        matches.push((first_char, highlights));
+    }
+    matches
+}
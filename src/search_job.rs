@@ -0,0 +1,159 @@
+use crate::archive::Archive;
+use crate::book::TermSize;
+use crate::cache::{ChapterCache, LayoutCache};
+use crate::image::ImageStore;
+use crate::layout;
+use crate::parser::Decorator;
+use crate::search::{ChapterText, Highlight, Matcher};
+use pyo3::prelude::*;
+use std::sync::atomic::{AtomicBool, Ordering};
+use std::sync::{Arc, Mutex};
+use std::thread;
+
+// highlights of a query in a chapter, matched on a background thread
+// while the query is being typed. a newer job cancels the one it replaces.
+#[pyclass]
+pub struct SearchJob {
+    cancelled: Arc<AtomicBool>,
+    result: Arc<Mutex<Option<Vec<Highlight>>>>,
+}
+
+impl SearchJob {
+    // `text` is called on the job's thread, building the text of a chapter
+    // not searched before takes longer than most matches.
+    pub fn spawn<F>(text: F, matcher: Matcher) -> SearchJob
+    where
+        F: FnOnce() -> Arc<ChapterText> + Send + 'static,
+    {
+        let cancelled = Arc::new(AtomicBool::new(false));
+        let result = Arc::new(Mutex::new(None));
+        {
+            let cancelled = cancelled.clone();
+            let result = result.clone();
+            thread::spawn(move || {
+                let text = text();
+                if let Some(highlights) = text.highlights_until(&matcher, &cancelled) {
+                    *result.lock().unwrap() = Some(highlights);
+                }
+            });
+        }
+        SearchJob { cancelled, result }
+    }
+
+    // a handle on the same job
+    pub fn share(&self) -> SearchJob {
+        SearchJob {
+            cancelled: self.cancelled.clone(),
+            result: self.result.clone(),
+        }
+    }
+}
+
+#[pymethods]
+impl SearchJob {
+    // the highlights once matched
+    fn result(&self) -> Option<Vec<Highlight>> {
+        self.result.lock().unwrap().clone()
+    }
+
+    pub fn cancel(&self) {
+        self.cancelled.store(true, Ordering::Relaxed);
+    }
+}
+
+// the first of the candidate `chapters` (in order) with matches of a query,
+// looked for on a background thread with its own handle to the (mapped)
+// epub. a chapter laid out here is only searched: it is neither stored
+// nor kept in memory, nor are its images extracted.
+#[pyclass]
+pub struct ChapterSearchJob {
+    cancelled: Arc<AtomicBool>,
+    done: Arc<AtomicBool>,
+    result: Arc<Mutex<Option<(usize, Vec<Highlight>)>>>,
+}
+
+impl ChapterSearchJob {
+    pub fn spawn(
+        archive: Arc<Archive>,
+        chapters: Vec<usize>,
+        images: Arc<ImageStore>,
+        layout_cache: LayoutCache,
+        chapter_cache: Arc<Mutex<ChapterCache>>,
+        term_info: TermSize,
+        matcher: Matcher,
+    ) -> ChapterSearchJob {
+        let cancelled = Arc::new(AtomicBool::new(false));
+        let done = Arc::new(AtomicBool::new(false));
+        let result = Arc::new(Mutex::new(None));
+        {
+            let cancelled = cancelled.clone();
+            let done = done.clone();
+            let result = result.clone();
+            thread::spawn(move || {
+                if let Some(mut book) = archive.open() {
+                    for chapter in chapters {
+                        if cancelled.load(Ordering::Relaxed) {
+                            return;
+                        }
+                        let cached = chapter_cache.lock().unwrap().get(&(chapter, term_info));
+                        let text = match cached {
+                            Some(doc) => ChapterText::from_doc(&doc),
+                            None => {
+                                let html = archive
+                                    .chapter(&mut book, chapter)
+                                    .unwrap_or_else(|| Arc::from(""));
+                                images.probe(&html, &mut book);
+                                let decorator = Decorator::new(&images, term_info);
+                                let doc = layout_cache
+                                    .load_chapter(term_info, chapter, &decorator)
+                                    .unwrap_or_else(|| layout::render(&html, &images, term_info));
+                                ChapterText::from_doc(&doc)
+                            }
+                        };
+                        match text.highlights_until(&matcher, &cancelled) {
+                            Some(highlights) if !highlights.is_empty() => {
+                                *result.lock().unwrap() = Some((chapter, highlights));
+                                break;
+                            }
+                            Some(_) => {}
+                            None => return,
+                        }
+                    }
+                }
+                done.store(true, Ordering::Release);
+            });
+        }
+        ChapterSearchJob {
+            cancelled,
+            done,
+            result,
+        }
+    }
+
+    // a handle on the same job
+    pub fn share(&self) -> ChapterSearchJob {
+        ChapterSearchJob {
+            cancelled: self.cancelled.clone(),
+            done: self.done.clone(),
+            result: self.result.clone(),
+        }
+    }
+}
+
+#[pymethods]
+impl ChapterSearchJob {
+    // whether every candidate was searched, or one with matches found
+    #[getter]
+    fn done(&self) -> bool {
+        self.done.load(Ordering::Acquire)
+    }
+
+    // (chapter, highlights) of the chapter found, once done
+    fn result(&self) -> Option<(usize, Vec<Highlight>)> {
+        self.result.lock().unwrap().clone()
+    }
+
+    pub fn cancel(&self) {
+        self.cancelled.store(true, Ordering::Relaxed);
+    }
+}
@@ -0,0 +1,85 @@
+use std::collections::{BTreeMap, HashMap};
+use std::sync::atomic::{AtomicBool, Ordering};
+use std::sync::{Arc, Mutex};
+use std::time::Instant;
+
+// latencies in buckets of powers of two microseconds, bucket i counts
+// the latencies below 2^i us (and above the previous bucket).
+#[derive(Default)]
+struct Histogram {
+    counts: Vec<u64>,
+}
+
+impl Histogram {
+    fn record(&mut self, micros: u64) {
+        let bucket = (64 - micros.leading_zeros()) as usize;
+        if self.counts.len() <= bucket {
+            self.counts.resize(bucket + 1, 0);
+        }
+        self.counts[bucket] += 1;
+    }
+
+    // upper bound (us) -> count, of the non empty buckets
+    fn buckets(&self) -> BTreeMap<u64, u64> {
+        self.counts
+            .iter()
+            .enumerate()
+            .filter(|(_, &count)| count > 0)
+            .map(|(bucket, &count)| (1 << bucket, count))
+            .collect()
+    }
+}
+
+// opt-in latency histograms of named stages, shared by the book
+// and the threads working for it. disabled, a timer costs an atomic load.
+#[derive(Default)]
+pub struct Timings {
+    enabled: AtomicBool,
+    histograms: Mutex<HashMap<&'static str, Histogram>>,
+}
+
+impl Timings {
+    pub fn enable(&self) {
+        self.enabled.store(true, Ordering::Relaxed);
+    }
+
+    fn record(&self, stage: &'static str, micros: u64) {
+        let mut histograms = self.histograms.lock().unwrap();
+        histograms.entry(stage).or_default().record(micros);
+    }
+
+    pub fn histograms(&self) -> HashMap<String, BTreeMap<u64, u64>> {
+        self.histograms
+            .lock()
+            .unwrap()
+            .iter()
+            .map(|(stage, histogram)| (stage.to_string(), histogram.buckets()))
+            .collect()
+    }
+}
+
+// records the time until it is dropped under `stage`
+pub struct Timer {
+    timings: Option<Arc<Timings>>,
+    stage: &'static str,
+    start: Instant,
+}
+
+impl Timer {
+    pub fn start(timings: &Arc<Timings>, stage: &'static str) -> Timer {
+        let enabled = timings.enabled.load(Ordering::Relaxed);
+        Timer {
+            timings: if enabled { Some(timings.clone()) } else { None },
+            stage,
+            start: Instant::now(),
+        }
+    }
+}
+
+impl Drop for Timer {
+    fn drop(&mut self) {
+        if let Some(timings) = &self.timings {
+            timings.record(self.stage, self.start.elapsed().as_micros() as u64);
+        }
+    }
+}
@@ -0,0 +1,39 @@
+use crate::doc::Doc;
+use crate::image::Image;
+use pyo3::prelude::*;
+use std::sync::Arc;
+
+// lines [start, end) of a rendered chapter. rows are numbered from the
+// start of the chapter, nothing is copied out of the chapter until asked.
+#[pyclass]
+pub struct ChapterView {
+    doc: Arc<Doc>,
+    #[pyo3(get)]
+    start: usize,
+    #[pyo3(get)]
+    end: usize,
+}
+
+impl ChapterView {
+    // a view on all lines of `doc`
+    pub fn new(doc: Arc<Doc>) -> ChapterView {
+        let end = doc.len();
+        ChapterView { doc, start: 0, end }
+    }
+}
+
+#[pymethods]
+impl ChapterView {
+    // (column, text, style bits) of the text spans of a row
+    fn spans(&self, row: usize) -> Vec<(u32, &str, u32)> {
+        self.doc.text_spans(row)
+    }
+
+    fn word_counts(&self) -> Vec<usize> {
+        self.doc.word_counts(self.start, self.end)
+    }
+
+    fn images(&self) -> Vec<((u32, usize), Image)> {
+        self.doc.images(self.start, self.end)
+    }
+}
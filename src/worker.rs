@@ -0,0 +1,74 @@
+use crate::archive::Archive;
+use crate::book::TermSize;
+use crate::cache::{ChapterCache, LayoutCache};
+use crate::doc::Doc;
+use crate::image::ImageStore;
+use crate::parser::Decorator;
+use std::sync::mpsc::{channel, Sender};
+use std::sync::{Arc, Mutex};
+use std::thread;
+
+pub enum Job {
+    // render a chapter into the shared chapter cache,
+    // extracting the images it references along the way.
+    Render(usize, TermSize),
+    // extract the images of a rendered chapter (whose dimensions were
+    // only probed) and write their downscaled copies
+    Scale(usize, Arc<Doc>),
+}
+
+// background thread with its own handle to the (mapped) epub,
+// so its jobs never wait on (or move) the reader's current chapter.
+// the thread exits once the owning `Book` drops the worker.
+pub struct Worker {
+    sender: Sender<Job>,
+}
+
+impl Worker {
+    pub fn spawn(
+        archive: Arc<Archive>,
+        images: Arc<ImageStore>,
+        layout_cache: LayoutCache,
+        chapters: Arc<Mutex<ChapterCache>>,
+    ) -> Worker {
+        let (sender, receiver) = channel();
+        thread::spawn(move || {
+            let mut book = match archive.open() {
+                Some(book) => book,
+                None => return,
+            };
+            for job in receiver {
+                match job {
+                    Job::Render(chapter, term_info) => {
+                        let key = (chapter, term_info);
+                        if chapters.lock().unwrap().contains(&key) {
+                            continue;
+                        }
+                        let html = match archive.chapter(&mut book, chapter) {
+                            Some(html) => html,
+                            None => continue,
+                        };
+                        images.extract(&html, &mut book);
+                        let decorator = Decorator::new(&images, term_info);
+                        let doc = Arc::new(layout_cache.load_or_render(chapter, &html, decorator));
+                        chapters.lock().unwrap().insert(key, doc.clone());
+                        images.scale_all(&doc);
+                    }
+                    Job::Scale(chapter, doc) => {
+                        if let Some(html) = archive.chapter(&mut book, chapter) {
+                            images.extract(&html, &mut book);
+                        }
+                        images.scale_all(&doc);
+                    }
+                }
+            }
+        });
+        Worker { sender }
+    }
+
+    pub fn submit(&self, job: Job) {
+        // the thread only goes away with the epub it failed to open,
+        // in which case there is nothing to do anyway.
+        let _ = self.sender.send(job);
+    }
+}